@@ -1,2 +1,15 @@
 from .graph import measure_graphs
-from .sumorunner import run_simulation
+from .trace import TraceWriter, read_trace, read_snapshots, load_index, convert_dat
+from .store import MetricsStore, DBAPISink
+from .writer import BufferedWriter
+from .instrument import Instrumentation
+from .snapshot import SnapshotGraph, GraphArchive, read_graph, read_graphs
+from .stream import measure_simulation
+
+
+def __getattr__(name):
+    # sumorunner needs SUMO_HOME and traci at import time, so it is only loaded when used.
+    if name == "run_simulation":
+        from .sumorunner import run_simulation
+        return run_simulation
+    raise AttributeError("module %s has no attribute %s"%(__name__, name))
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .cube import LEVELS
+from .query import RhythmQuery
+from .render import FIGURE_NAMES, SCATTER, draw
+from .store import STORE_PATH, MetricsStore
+
+OUTPUT_ROOT = "figures/"
+MANIFEST = "manifest.json"
+MEASURES = ("degree",)
+COLORS = ("plasma",)
+WINDOWS = ((0., 24.),)
+
+
+def store_version(path):
+    with MetricsStore(path) as store:
+        return store.version()
+
+def load_manifest(root):
+    path = os.path.join(root, MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def output_path(root, measure, color, interval, window, name):
+    return os.path.join(root, "%s_%s_%gmin_%g-%gh_%s.png"%(measure, color, interval, window[0], window[1], name))
+
+def render_window(path, measure, interval, window, outputs):
+    # outputs: (figure index, color, output path) of one store window.
+    start, end = window[0] * 60. * 60., window[1] * 60. * 60.
+    query = RhythmQuery(path)
+    try:
+        cells = query.window(measure, start, end, interval)
+        raster = query.raster(measure, start, end) if any(index == SCATTER for index, _, _ in outputs) else None
+    finally:
+        query.close()
+    if len(cells) == 0:
+        return []
+    for index, color, output in outputs:
+        fig = draw(index, cells, interval, measure, color, raster if index == SCATTER else None)
+        fig.savefig(output + ".tmp", format="png")
+        os.replace(output + ".tmp", output)
+    return [output for _, _, output in outputs]
+
+def plan_figures(path, root, measures, colors, intervals, windows, figures, manifest, version, force=False):
+    # Figures rendered from the current version of the store are up to date and skipped.
+    tasks = []
+    for measure, interval, window in itertools.product(measures, intervals, windows):
+        outputs = []
+        for name, color in itertools.product(figures, colors):
+            output = output_path(root, measure, color, interval, window, name)
+            if force or not os.path.isfile(output) or manifest.get(os.path.basename(output)) != version:
+                outputs.append((FIGURE_NAMES.index(name), color, output))
+        if outputs:
+            tasks.append((path, measure, interval, window, outputs))
+    return tasks
+
+def render_figures(path=STORE_PATH, root=OUTPUT_ROOT, measures=MEASURES, colors=COLORS, intervals=LEVELS,
+                   windows=WINDOWS, figures=FIGURE_NAMES, n_workers=None, force=False):
+    unknown = set(figures) - set(FIGURE_NAMES)
+    if unknown:
+        raise ValueError("Unknown figures %s, use any of %s."%(sorted(unknown), FIGURE_NAMES))
+    if not os.path.isfile(path):
+        raise ValueError("%s is not a metrics store."%(path))
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    version = store_version(path)
+    manifest = load_manifest(root)
+    tasks = plan_figures(path, root, measures, colors, intervals, windows, figures, manifest, version, force)
+    written = []
+    try:
+        with ProcessPoolExecutor(n_workers) as executor:
+            for future in as_completed([executor.submit(render_window, *task) for task in tasks]):
+                for output in future.result():
+                    manifest[os.path.basename(output)] = version
+                    written.append(output)
+    finally:
+        save_manifest(root, manifest)
+    return written
+
+def parse_window(text):
+    start, end = text.split("-")
+    return float(start), float(end)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render graph visual rhythm figures from a metrics store.")
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--output", default=OUTPUT_ROOT)
+    parser.add_argument("--measures", nargs="+", default=MEASURES)
+    parser.add_argument("--colors", nargs="+", default=COLORS, help="color maps accepted by render.get_color")
+    parser.add_argument("--intervals", nargs="+", type=float, default=LEVELS, help="minutes")
+    parser.add_argument("--windows", nargs="+", type=parse_window, default=WINDOWS, help="start-end in hours")
+    parser.add_argument("--figures", nargs="+", default=FIGURE_NAMES, choices=FIGURE_NAMES)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="render figures that are already up to date")
+    args = parser.parse_args(argv)
+    written = render_figures(args.store, args.output, args.measures, args.colors, args.intervals, args.windows,
+                             args.figures, args.workers, args.force)
+    print("%s figures written to %s."%(len(written), args.output))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from .graph import (TRANSMISSION_RANGE, connecting_nodes, measure_graphs, neighbor_edges, parse_lines,
+                    snapshot_metrics, unique_vehicles)
+from .store import MetricsStore
+from .trace import is_trace, open_writer, read_snapshots
+from .writer import JSONSink
+
+SIZES = (1000, 10000, 100000)
+DISTRIBUTIONS = ("uniform", "grid", "replay")
+# Vehicles per square kilometre, about six neighbors within TRANSMISSION_RANGE.
+DENSITY = 50.
+BLOCK = 150.
+LANE_JITTER = 5.
+SPEED = 10.
+STEP = 60.
+
+
+def area_side(n_vehicles, density=DENSITY):
+    return np.sqrt(n_vehicles / density) * 1000.
+
+def uniform_positions(n_vehicles, rng, side):
+    return rng.uniform(0., side, (n_vehicles, 2))
+
+def grid_positions(n_vehicles, rng, side, block=BLOCK):
+    # Vehicles along a Manhattan road grid, a third of them queued near intersections.
+    n_lines = max(int(side // block), 1)
+    pos = np.empty((n_vehicles, 2))
+    along = rng.uniform(0., side, n_vehicles)
+    queued = rng.random(n_vehicles) < 1. / 3.
+    along[queued] = np.round(along[queued] / block) * block + rng.normal(0., block / 10., np.count_nonzero(queued))
+    across = rng.integers(0, n_lines + 1, n_vehicles) * block + rng.normal(0., LANE_JITTER, n_vehicles)
+    vertical = rng.random(n_vehicles) < 0.5
+    pos[:, 0] = np.where(vertical, across, along)
+    pos[:, 1] = np.where(vertical, along, across)
+    return np.clip(pos, 0., side)
+
+def replay_positions(n_vehicles, rng, source):
+    # Resamples a recorded snapshot, scaled so the density is kept at any size.
+    _, _, pos = source
+    pos = np.asarray(pos, dtype=np.float64)
+    scale = np.sqrt(n_vehicles / float(len(pos)))
+    picked = pos[rng.integers(0, len(pos), n_vehicles)] - pos.min(axis=0)
+    offsets = rng.integers(0, int(np.ceil(scale)), (n_vehicles, 2)) * (np.ptp(pos, axis=0) + TRANSMISSION_RANGE)
+    return picked + offsets + rng.normal(0., LANE_JITTER, (n_vehicles, 2))
+
+def synthetic_positions(distribution, n_vehicles, rng, replay=None):
+    side = area_side(n_vehicles)
+    if distribution == "uniform":
+        return uniform_positions(n_vehicles, rng, side)
+    elif distribution == "grid":
+        return grid_positions(n_vehicles, rng, side)
+    elif distribution == "replay":
+        if replay is None:
+            raise ValueError("The replay distribution needs a recorded trace.")
+        return replay_positions(n_vehicles, rng, read_first(replay))
+    raise ValueError("Unknown distribution %s, use one of %s."%(distribution, DISTRIBUTIONS))
+
+def write_synthetic_trace(path, distribution, n_vehicles, n_snapshots=3, trace_format="dat", seed=0, replay=None,
+                          step=STEP):
+    # Writers append, so an existing trace and its index are replaced.
+    for name in (path, path + ".idx"):
+        if os.path.isfile(name):
+            os.remove(name)
+    rng = np.random.default_rng(seed)
+    pos = synthetic_positions(distribution, n_vehicles, rng, replay)
+    ids = np.arange(1, n_vehicles + 1, dtype=np.uint32)
+    with open_writer(path, trace_format) as writer:
+        for i in range(n_snapshots):
+            writer.write(i * step, ids, pos.astype(np.float32))
+            pos = pos + rng.normal(0., SPEED * step / 2., pos.shape)
+    return path
+
+
+def measure_stage(function, *args):
+    # Timing and peak memory come from separate runs, tracemalloc slows allocations down.
+    start, cpu = time.perf_counter(), time.process_time()
+    result = function(*args)
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, dict(wall=wall, cpu=cpu, peak_bytes=peak)
+
+def read_first(path):
+    for snapshot in read_snapshots(path):
+        return snapshot if is_trace(path) else parse_lines(snapshot)
+    raise ValueError("%s has no snapshots."%(path))
+
+def store_sqlite(path, data):
+    with MetricsStore(path) as store:
+        store.write([data])
+
+def store_json(root, data):
+    JSONSink(root).write([data])
+
+def stage_results(distribution, n_vehicles, trace_format, measures, workdir, replay=None, n_snapshots=3):
+    path = os.path.join(workdir, "%s_%s.%s"%(distribution, n_vehicles, "gvrt" if trace_format == "binary" else "dat"))
+    results = []
+
+    def record(stage, stats, **extra):
+        stats.update(distribution=distribution, vehicles=n_vehicles, stage=stage,
+                     throughput=n_vehicles / stats["wall"] if stats["wall"] else None, **extra)
+        results.append(stats)
+
+    _, stats = measure_stage(write_synthetic_trace, path, distribution, n_vehicles, n_snapshots, trace_format, 0,
+                             replay)
+    record("write", stats, snapshots=n_snapshots)
+
+    (t, labels, pos), stats = measure_stage(read_first, path)
+    record("parse", stats)
+    labels, pos = unique_vehicles(labels, pos)
+
+    edges, stats = measure_stage(neighbor_edges, pos, TRANSMISSION_RANGE, 1)
+    record("edges", stats, edges=len(edges))
+    _, stats = measure_stage(connecting_nodes, labels, pos, 1)
+    record("connecting_nodes", stats, edges=len(edges))
+
+    data, stats = measure_stage(snapshot_metrics, t, labels, edges, measures)
+    record("metrics", stats, measures=list(measures))
+
+    db = os.path.join(workdir, "bench.db")
+    _, stats = measure_stage(store_sqlite, db, data)
+    record("store_sqlite", stats)
+    _, stats = measure_stage(store_json, os.path.join(workdir, "graph_doc"), data)
+    record("store_json", stats)
+    return path, results
+
+def scaling_results(path, worker_counts, measures, workdir):
+    results = []
+    n_snapshots = sum(1 for _ in read_snapshots(path))
+    for n_workers in worker_counts:
+        db = os.path.join(workdir, "scaling_%s.db"%(n_workers))
+        start = time.perf_counter()
+        measure_graphs(path, n_proc=1, n_workers=n_workers if n_workers > 1 else None, measures=measures, store=db)
+        wall = time.perf_counter() - start
+        results.append(dict(trace=os.path.basename(path), workers=n_workers, wall=wall,
+                            snapshots_per_second=n_snapshots / wall))
+    for result in results:
+        result["speedup"] = results[0]["wall"] / result["wall"]
+    return results
+
+def run_benchmarks(sizes=SIZES, distributions=DISTRIBUTIONS, worker_counts=(1, 2, 4), measures=("degree",),
+                   trace_format="dat", replay=None, n_snapshots=3, workdir=None):
+    if "replay" in distributions and replay is None:
+        distributions = [d for d in distributions if d != "replay"]
+    own = workdir is None
+    workdir = tempfile.mkdtemp(prefix="gvr_bench_") if own else workdir
+    stages = []
+    scaling = []
+    try:
+        for distribution in distributions:
+            for n_vehicles in sizes:
+                path, results = stage_results(distribution, n_vehicles, trace_format, measures, workdir, replay,
+                                              n_snapshots)
+                stages.extend(results)
+            scaling.extend(scaling_results(path, worker_counts, measures, workdir))
+    finally:
+        if own:
+            shutil.rmtree(workdir, ignore_errors=True)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    meta = dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                numpy=np.__version__, machine=platform.machine(), cpus=os.cpu_count(),
+                peak_rss_kb=usage.ru_maxrss, children_peak_rss_kb=children.ru_maxrss,
+                trace_format=trace_format, snapshots=n_snapshots)
+    return dict(meta=meta, stages=stages, scaling=scaling)
+
+def compare_results(baseline, current, tolerance=0.2):
+    # Stages whose wall time grew by more than `tolerance` against the baseline.
+    key = lambda r: (r["distribution"], r["vehicles"], r["stage"])
+    before = dict((key(r), r) for r in baseline["stages"])
+    regressions = []
+    for result in current["stages"]:
+        old = before.get(key(result))
+        if old and old["wall"] > 0:
+            ratio = result["wall"] / old["wall"]
+            if ratio > 1. + tolerance:
+                regressions.append(dict(distribution=result["distribution"], vehicles=result["vehicles"],
+                                        stage=result["stage"], before=old["wall"], after=result["wall"], ratio=ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the measurement pipeline on synthetic traces.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--distributions", nargs="+", default=DISTRIBUTIONS, choices=DISTRIBUTIONS)
+    parser.add_argument("--workers", nargs="+", type=int, default=(1, 2, 4))
+    parser.add_argument("--measures", nargs="+", default=("degree",))
+    parser.add_argument("--snapshots", type=int, default=3)
+    parser.add_argument("--trace-format", default="dat", choices=("dat", "binary"))
+    parser.add_argument("--replay", default=None, help="trace whose first snapshot is resampled")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.distributions, args.workers, args.measures, args.trace_format,
+                             args.replay, args.snapshots)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    for r in results["stages"]:
+        print("%-8s %7s %-16s %9.4fs %12.0f veh/s %8.1f MB"%(
+            r["distribution"], r["vehicles"], r["stage"], r["wall"], r["throughput"] or 0, r["peak_bytes"] / 2.**20))
+    for r in results["scaling"]:
+        print("%-20s %2s workers %9.3fs speedup %.2f"%(r["trace"], r["workers"], r["wall"], r["speedup"]))
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        for r in regressions:
+            print("Regression: %s %s %s %.4fs -> %.4fs (x%.2f)"%(
+                r["distribution"], r["vehicles"], r["stage"], r["before"], r["after"], r["ratio"]))
+        if regressions:
+            sys.exit(1)
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import numpy as np
+
+# Aggregation levels in minutes, the choices of the interface interval box.
+LEVELS = (1, 5, 10, 15, 30, 60, 120)
+HIST_BINS = 64
+# Centralities of large snapshots are tiny, so values are binned on a log scale
+# down to MIN_VALUE, with one more bin for [0, MIN_VALUE).
+MIN_VALUE = 1e-5
+# Measures not bounded by 1 are aggregated after dividing by the snapshot size minus one.
+SIZE_NORMALIZED = ("harmonic",)
+# Measures of a range sweep are stored as <measure>@<range name>.
+RANGE_SEPARATOR = "@"
+RHYTHM_DTYPE = np.dtype([('bucket', 'i8'), ('time', 'f8'), ('n_snapshots', 'i8'), ('count', 'i8'),
+                         ('sum', 'f8'), ('max', 'f8'), ('hist', 'i8', (HIST_BINS,))])
+
+
+def bucket_width(level):
+    return level * 60.
+
+def bucket_range(start, end, width):
+    # First and last bucket lying wholly inside [start, end], the rule every window follows.
+    first = -2**62 if start is None else int(np.ceil(start / width))
+    last = 2**62 if end is None else int(np.floor(end / width)) - 1
+    return first, last
+
+def size_normalized(measure):
+    return measure.split(RANGE_SEPARATOR)[0] in SIZE_NORMALIZED
+
+def normalize(measure, times, values):
+    if size_normalized(measure):
+        _, inverse, counts = np.unique(times, return_inverse=True, return_counts=True)
+        values = values / np.maximum(counts[inverse] - 1, 1)
+    return values
+
+def value_bins(values, bins=HIST_BINS):
+    return np.clip(np.searchsorted(bin_edges(bins), values, side='right') - 1, 0, bins - 1)
+
+def bin_edges(bins=HIST_BINS):
+    return np.append(0., np.logspace(np.log10(MIN_VALUE), 0., bins))
+
+def rhythm_cells(measure, times, values, level):
+    # One cell per time bucket of `level` minutes holding the vehicle count,
+    # sum, maximum and value histogram of every snapshot in the bucket.
+    times = np.asarray(times, dtype=np.float64)
+    values = normalize(measure, times, np.asarray(values, dtype=np.float64))
+    width = bucket_width(level)
+    buckets = np.floor(times / width).astype(np.int64)
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    n = len(keys)
+    cells = np.zeros(n, dtype=RHYTHM_DTYPE)
+    cells['bucket'] = keys
+    cells['time'] = keys * width
+    cells['count'] = np.bincount(inverse, minlength=n)
+    cells['sum'] = np.bincount(inverse, values, n)
+    maximum = np.full(n, -np.inf)
+    np.maximum.at(maximum, inverse, values)
+    cells['max'] = maximum
+    snapshots = np.unique(times)
+    cells['n_snapshots'] = np.bincount(np.searchsorted(keys, np.floor(snapshots / width).astype(np.int64)), minlength=n)
+    hist = np.bincount(inverse * HIST_BINS + value_bins(values), minlength=n * HIST_BINS)
+    cells['hist'] = hist.reshape(n, HIST_BINS)
+    return cells
+
+def combine_cells(*parts):
+    cells = np.concatenate(parts)
+    keys, first, inverse = np.unique(cells['bucket'], return_index=True, return_inverse=True)
+    combined = np.zeros(len(keys), dtype=RHYTHM_DTYPE)
+    combined['bucket'] = keys
+    combined['time'] = cells['time'][first]
+    combined['max'] = -np.inf
+    for name in ('n_snapshots', 'count', 'sum', 'hist'):
+        np.add.at(combined[name], inverse, cells[name])
+    np.maximum.at(combined['max'], inverse, cells['max'])
+    return combined
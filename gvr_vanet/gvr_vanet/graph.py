@@ -1,125 +1,230 @@
 import os
-import sys
 import time
-import json
+import warnings
+import cProfile
 import logging
 import logging.handlers as handlers
-from joblib import Parallel, delayed
+from functools import partial
+from joblib import Parallel, delayed, cpu_count
 
 import numpy as np
 from scipy import spatial
-# try:
-#     import graph_tool as gt
-# except ImportError:
-import networkx as nx
+
+from .cube import RANGE_SEPARATOR
+from .instrument import timed
+from .metrics import DEFAULT_MEASURES, centralities, density
+from .pipeline import run_pipeline
+from .snapshot import EDGE_DTYPE, GraphArchive, snapshot_graph
+from .store import STORE_PATH
+from .trace import is_trace, read_snapshots, read_trace
+from .writer import BATCH_SIZE, FLUSH_INTERVAL, BufferedWriter, JSONSink, MongoSink, open_sink
 
 GRAPH_ROOT = "graph_doc/"
 LAST_TIME_READ = -1
+TRANSMISSION_RANGE = 200.0
 
-def density(G):
-    n = G.num_vertices()
-    m = G.num_edges()
-    if m == 0 or n <= 1:
-      return 0.0
-    return 2 * m / (n * (n - 1))
-
-def get_metrics(G, t):
-    if "graph_tool" in sys.modules:
-        return dict(
-            time=t,
-            nodes=list(G.vp.label),
-            n_vehicle=G.num_vertices(),
-            degree=list(np.array(G.degree_property_map('total').get_array()) / (G.num_vertices() - 1)),
-            density=density(G)
-        )
-    else:
-        return dict(
-            time=t,
-            labels=list(dict(G.nodes(data='label')).values()),
-            n_vehicle=G.number_of_nodes(),
-            degree=nx.degree_centrality(G),
-            density=nx.density(G)
-        )
-
-def store_graph(G, dir_name, pos, labels):
-    path = os.path.join(GRAPH_ROOT, dir_name)
-    if not os.path.isdir(path):
-        os.makedirs(path)
-    nx.write_sparse6(G, os.path.join(path, "graph.sparse6"))
-    np.savez_compressed(os.path.join(path, "node_pos.npz"), pos)
-    np.savez_compressed(os.path.join(path, "node_labels.npz"), labels)
-    weights = list(G.edges(data='weight'))
-    if weights:
-      np.savez_compressed(os.path.join(path, "edge_weights.npz"), np.array(weights)[:,-1])
+def graph_metrics(G, measures=DEFAULT_MEASURES, approx=None, n_jobs=1):
+    adj = G.adjacency()
+    data = dict(
+        time=G.time,
+        labels=G.labels,
+        n_vehicle=G.n_nodes,
+        density=density(adj)
+    )
+    data.update(centralities(adj, measures, approx, n_jobs))
+    return data
+
+def snapshot_metrics(t, labels, edges, measures=DEFAULT_MEASURES, approx=None, n_jobs=1):
+    return graph_metrics(snapshot_graph(t, labels, edges), measures, approx, n_jobs)
+
+def get_metrics(G, t, measures=DEFAULT_MEASURES, approx=None):
+    data = graph_metrics(G, measures, approx)
+    data["time"] = t
+    return data
+
+def store_graph(G, archive, pos=None):
+    # archive is an open GraphArchive, all snapshots of a run share a single file.
+    # Snapshots it already holds, written before a run was resumed, are skipped.
+    if G.time > archive.last_time:
+        archive.write(G, pos)
 
 
 def store_metrics(data, use_dir=False, db=None, collection=None):
-    if not db or not collection:
-        if use_dir:
-            file_path = os.path.join(str(data["time"]), "metrics.json")
-        else:
-            file_path = str(data["time"]) + ".json"
-        path = os.path.join(GRAPH_ROOT, file_path)
-        with open(path, "w") as f:
-            json.dump(data, f)
+    if db and collection:
+        sink = MongoSink(db, collection)
     else:
-        db[collection].insert_many(data)
+        sink = JSONSink(GRAPH_ROOT, use_dir)
+    sink.write([data])
 
 def cdist_mask(pos, th, n, sl):
     dist = spatial.distance.cdist([pos[n]], pos[sl]).ravel()
     mask = dist <= th
     receivers = np.arange(sl.start, sl.stop)
     senders = np.full_like(receivers, n)
-    dist = np.array(list(zip(senders, receivers, dist)), dtype='u4,u4,f4')
+    dist = np.array(list(zip(senders, receivers, dist)), dtype=EDGE_DTYPE)
     return dist[mask]
 
-def connecting_nodes(labels, pos, n_proc, dir_name=None):
-    n_nodes = len(labels)
-    transmission_range = 200.0
-
-    if "graph_tool" in sys.modules:
-        G = gt.Graph(directed=False)
-        G.add_vertex(n_nodes)
-        G.vp.label = G.new_vp("string", vals=labels)
-        G.ep.weight = G.new_ep("float")
-    else:
-        G = nx.Graph()
-        G.add_nodes_from([(idx, dict(label=l)) for idx, l in zip(range(n_nodes), labels)])
-
+def reference_edges(pos, th, n_proc):
+    n_nodes = len(pos)
+    results = [np.empty(0, dtype=EDGE_DTYPE)]
     with Parallel(n_jobs=n_proc) as parallel:
         for i in range(n_nodes - 1):
             size = n_nodes - (i + 1)
             if size > n_proc * 10:
-                step = size // n_proc
-                slices = [slice(start, start + step) for start in range(i + 1, (i + 1) + (size - 2 * step), step)]
-                slices.append(slice((i + 1) + (n_proc - 1) * step, n_nodes))
+                step = -(-size // n_proc)
+                slices = [slice(start, min(start + step, n_nodes)) for start in range(i + 1, n_nodes, step)]
             else:
                 slices = [slice(i + 1, n_nodes)]
-            results = Parallel(n_jobs=n_proc)(delayed(cdist_mask)(pos, transmission_range, i, sl) for sl in slices)
-            G.add_weighted_edges_from(np.concatenate(results, axis=0))
-    if dir_name:
-        store_graph(G, dir_name, pos, labels)
+            results.extend(parallel(delayed(cdist_mask)(pos, th, i, sl) for sl in slices))
+    return np.concatenate(results, axis=0)
+
+def kdtree_edges(pos, th, n_proc=None):
+    tree = spatial.cKDTree(pos)
+    pairs = tree.query_pairs(th, output_type='ndarray')
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    edges = np.empty(len(pairs), dtype=EDGE_DTYPE)
+    edges['f0'] = pairs[:, 0]
+    edges['f1'] = pairs[:, 1]
+    delta = pos[pairs[:, 0]].astype(np.float64) - pos[pairs[:, 1]]
+    edges['f2'] = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+    return edges
+
+NEIGHBOR_ENGINES = dict(kdtree=kdtree_edges, reference=reference_edges)
+
+def neighbor_edges(pos, th=TRANSMISSION_RANGE, n_proc=1, engine="kdtree"):
+    if engine not in NEIGHBOR_ENGINES:
+        raise ValueError("Unknown neighbor engine %s, use one of %s."%(engine, sorted(NEIGHBOR_ENGINES)))
+    if len(pos) < 2:
+        return np.empty(0, dtype=EDGE_DTYPE)
+    return NEIGHBOR_ENGINES[engine](pos, th, n_proc)
+
+def connecting_nodes(labels, pos, n_proc, archive=None, engine="kdtree", th=TRANSMISSION_RANGE, time=None):
+    edges = neighbor_edges(pos, th, n_proc, engine)
+    G = snapshot_graph(time, labels, edges)
+    if archive:
+        store_graph(G, archive, pos)
     return G
 
-def process_lines(graph_lines, n_proc):
+def range_measure(measure, name):
+    return "%s%s%s"%(measure, RANGE_SEPARATOR, name)
+
+class RangeSweep(object):
+    # ranges is a list of transmission ranges in metres, or a dict from a name to a range or to a
+    # {vehicle class: range} dict with a "default" entry, classes maps vehicle ids to their class.
+    def __init__(self, ranges, classes=None):
+        if not isinstance(ranges, dict):
+            ranges = dict(("%g"%(th), float(th)) for th in sorted(ranges))
+        if not ranges:
+            raise ValueError("A range sweep needs at least one range.")
+        for name, th in ranges.items():
+            if isinstance(th, dict) and "default" not in th:
+                raise ValueError("The class ranges of %s need a default range."%(name))
+        self.ranges = list(ranges.items())
+        self.classes = {} if classes is None else classes
+        self.max_range = max(max(th.values()) if isinstance(th, dict) else th for th in ranges.values())
+
+    def node_ranges(self, labels, th):
+        return np.array([th.get(self.classes.get(l), th["default"]) for l in labels.tolist()], dtype=np.float32)
+
+    def split(self, labels, edges):
+        # Edges found once up to max_range, scalar ranges are prefixes of the distance order and a
+        # link between two classes needs the shorter of their ranges.
+        edges = edges[np.argsort(edges['f2'], kind='stable')]
+        for name, th in self.ranges:
+            if isinstance(th, dict):
+                reach = self.node_ranges(labels, th)
+                subset = edges[edges['f2'] <= np.minimum(reach[edges['f0']], reach[edges['f1']])]
+            else:
+                subset = edges[:np.searchsorted(edges['f2'], np.float32(th), side='right')]
+            yield name, subset
+
+    def metrics(self, time, labels, edges, measures=DEFAULT_MEASURES, approx=None, n_jobs=1, sample=None):
+        data = dict(time=time, labels=labels, n_vehicle=len(labels))
+        for name, subset in self.split(labels, edges):
+            result = timed(sample, "metrics", snapshot_metrics, time, labels, subset, measures, approx, n_jobs)
+            data.update((range_measure(key, name), value) for key, value in result.items() if key not in data)
+        return data
+
+def parse_lines(graph_lines):
+    block = graph_lines if isinstance(graph_lines, str) else "".join(graph_lines)
+    end = block.rindex("END")
+    time = float(block[end:].split(" ")[1])
+    lines = block[:end].splitlines()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(block[:end].replace(":", " "), dtype=np.float64, sep=" ")
+    except ValueError:
+        values = np.empty(0)
+    # fromstring may stop quietly at a bad token and ignores how values are split in lines.
+    if values.size != 3 * len(lines) or any(line.count(":") != 2 for line in lines):
+        for number, line in enumerate(lines):
+            try:
+                if len([float(field) for field in line.split(":")]) == 3:
+                    continue
+            except ValueError:
+                pass
+            raise ValueError("Malformed line %s %r in the snapshot ending at time %s, expected id:x:y."%(
+                number + 1, line, time))
+    values = values.reshape(-1, 3)
+    return time, values[:, 0].astype(np.uint32), values[:, 1:].astype(np.float32)
+
+def unique_vehicles(labels, pos):
+    # Keep the last position reported for each vehicle.
+    labels, idx = np.unique(labels[::-1], return_index=True)
+    return labels, pos[len(pos) - 1 - idx]
+
+def process_snapshot(time, labels, pos, n_proc, measures=DEFAULT_MEASURES, approx=None, sample=None, sweep=None,
+                     keep_graph=False):
+    labels, pos = unique_vehicles(labels, pos)
+    th = TRANSMISSION_RANGE if sweep is None else sweep.max_range
+    edges = timed(sample, "edges", neighbor_edges, pos, th, n_proc)
+    if sample is not None:
+        sample["n_edges"] = len(edges)
+    if sweep is not None:
+        data = sweep.metrics(time, labels, edges, measures, approx, n_proc, sample)
+    else:
+        data = timed(sample, "metrics", snapshot_metrics, time, labels, edges, measures, approx, n_proc)
+    if keep_graph:
+        # Handed to the committing thread, which owns the graph archive.
+        data["graph"] = snapshot_graph(time, labels, edges)
+        data["pos"] = pos
+    return data
+
+def process_lines(graph_lines, n_proc, measures=DEFAULT_MEASURES, approx=None, sample=None, sweep=None,
+                  keep_graph=False):
     if graph_lines:
-        n_lines = len(graph_lines)
-        pos = np.zeros(((n_lines - 1), 2), dtype=np.float32)
-        labels = np.full((n_lines - 1), fill_value='0', dtype='U8')
-        for i in range(n_lines - 1):
-            id_, x, y = graph_lines[i].split(":")
-            labels[i] = id_
-            pos[i][0] = float(x)
-            pos[i][1] = float(y)
-        time = graph_lines[-1].split(" ")[1]
-        labels = np.flip(labels)
-        pos = np.flip(pos, 0)
-        labels, idx = np.unique(labels, return_index=True)
-        pos = pos[idx, :]
-        G = connecting_nodes(labels, pos, n_proc)#, dir_name=str(time))
-        return get_metrics(G, time)
+        time, labels, pos = timed(sample, "parse", parse_lines, graph_lines)
+        return process_snapshot(time, labels, pos, n_proc, measures, approx, sample, sweep, keep_graph)
     return None
 
+def process_trace_snapshot(snapshot, n_proc, measures=DEFAULT_MEASURES, approx=None, sample=None, sweep=None,
+                           keep_graph=False):
+    time, ids, pos = snapshot
+    return process_snapshot(time, ids, pos, n_proc, measures, approx, sample, sweep, keep_graph)
+
+def snapshot_time(item):
+    if isinstance(item, tuple):
+        return float(item[0])
+    block = item if isinstance(item, str) else item[-1]
+    return float(block[block.rindex("END"):].split(" ")[1])
+
+def timed_process(process, item, n_proc, measures=DEFAULT_MEASURES, approx=None, instrument=False, profile=None):
+    # profile is (start, end, directory), snapshots in that time range are run under cProfile.
+    sample = {} if instrument else None
+    profiler = None
+    if profile is not None and item and profile[0] <= snapshot_time(item) <= profile[1]:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.time()
+    try:
+        result = process(item, n_proc, measures, approx, sample)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile[2], "snapshot_%s.prof"%(snapshot_time(item))))
+    return result, time.time() - start, sample
+
 def read_file_graph(rawgraph):
     global LAST_TIME_READ
     with open(rawgraph, "r") as file_:
@@ -136,9 +241,10 @@ def read_file_graph(rawgraph):
                     yield tmp_lines
     return None
 
-def measure_graphs(rawgraph='raw_graph.dat', n_proc=None, db=None, collection=None, last_read_time=-1):
-    global LAST_TIME_READ
-    LAST_TIME_READ = last_read_time
+def measure_snapshots(snapshots, process, n_proc=None, db=None, collection=None, n_workers=None, max_in_flight=None,
+                      ordered=True, measures=DEFAULT_MEASURES, approx=None,
+                      store=STORE_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, instrument=None,
+                      sweep=None, graph_archive=None):
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     file_logger = logging.getLogger('Logger')
     file_logger.setLevel(logging.DEBUG)
@@ -149,16 +255,87 @@ def measure_graphs(rawgraph='raw_graph.dat', n_proc=None, db=None, collection=No
     file_handler.setFormatter(formatter)
     file_logger.addHandler(file_handler)
 
-    if not os.path.isdir(GRAPH_ROOT):
-        os.makedirs(GRAPH_ROOT)
+    # Snapshots are committed by a background thread, in batches, to the
+    # metrics store, to JSON files in GRAPH_ROOT (store=None) or to db[collection].
+    if graph_archive is not None and n_workers and not ordered:
+        raise ValueError("Archiving graphs needs ordered commits, the archive is indexed by time.")
+    sink = open_sink(store, db, collection, GRAPH_ROOT)
+    writer = BufferedWriter(sink, batch_size, flush_interval, instrument=instrument)
+    if sweep is not None:
+        process = partial(process, sweep=sweep)
+    # One archive for the whole run, written as snapshots are committed.
+    archive = None
+    if graph_archive is not None:
+        archive = GraphArchive(graph_archive)
+        process = partial(process, keep_graph=True)
+    profile = None
+    if instrument is not None:
+        profile = instrument.profile()
+        snapshots = instrument.iterate("read", snapshots)
 
-    n_proc = cpu_count() if not n_proc else n_proc
-    graph_lines_generator = read_file_graph(rawgraph)
-    for graph_lines in graph_lines_generator:
-        start = time.time()
-        json_measuments = process_lines(graph_lines, n_proc)
+    def commit(result):
+        json_measuments, duration, sample = result
+        if sample is not None:
+            instrument.add_sample(sample, duration, json_measuments)
+        if json_measuments and archive is not None:
+            store_graph(json_measuments.pop("graph"), archive, json_measuments.pop("pos"))
         if json_measuments:
-            store_metrics(json_measuments, db, collection)
-            file_logger.info("Graph %s:\n\t\tDuration -> %s\n\t\tGraph Size -> %s"%(json_measuments["time"], time.time() - start, json_measuments["n_vehicle"]))
+            writer.append(json_measuments)
+            file_logger.info("Graph %s:\n\t\tDuration -> %s\n\t\tGraph Size -> %s"%(json_measuments["time"], duration, json_measuments["n_vehicle"]))
         else:
             file_logger.info("None")
+
+    if instrument is not None:
+        instrument.start(writer, n_workers or 1)
+    try:
+        if n_workers:
+            # Each worker builds whole snapshots, so nested joblib pools are disabled.
+            worker = partial(timed_process, process, n_proc=1, measures=measures, approx=approx,
+                             instrument=instrument is not None, profile=profile)
+            run_pipeline(snapshots, worker, commit, n_workers, max_in_flight, ordered)
+        else:
+            n_proc = cpu_count() if not n_proc else n_proc
+            for item in snapshots:
+                commit(timed_process(process, item, n_proc, measures, approx, instrument is not None, profile))
+    finally:
+        try:
+            writer.close()
+        finally:
+            if sink is not store:
+                sink.close()
+            if archive is not None:
+                archive.close()
+            if instrument is not None:
+                instrument.report()
+
+def last_checkpoint(store=STORE_PATH, db=None, collection=None):
+    sink = open_sink(store, db, collection, GRAPH_ROOT)
+    try:
+        return sink.checkpoint()
+    finally:
+        if sink is not store:
+            sink.close()
+
+def measure_graphs(rawgraph='raw_graph.dat', n_proc=None, db=None, collection=None, last_read_time=-1,
+                   n_workers=None, max_in_flight=None, ordered=True, end_time=None, snapshot_range=None,
+                   measures=DEFAULT_MEASURES, approx=None, store=STORE_PATH, batch_size=BATCH_SIZE,
+                   flush_interval=FLUSH_INTERVAL, resume=False, instrument=None, ranges=None, classes=None,
+                   graph_archive=None):
+    global LAST_TIME_READ
+    if resume:
+        if n_workers and not ordered:
+            raise ValueError("Resuming needs ordered commits, the checkpoint of an unordered run may skip snapshots.")
+        last_read_time = max(last_read_time, last_checkpoint(store, db, collection))
+    LAST_TIME_READ = last_read_time
+
+    process = process_trace_snapshot if is_trace(rawgraph) else process_lines
+    if last_read_time > -1 or end_time is not None or snapshot_range is not None:
+        # Seek straight to the requested snapshots through the sidecar index.
+        snapshots = read_snapshots(rawgraph, last_read_time, end_time, snapshot_range)
+    elif is_trace(rawgraph):
+        snapshots = read_trace(rawgraph, last_read_time)
+    else:
+        snapshots = read_file_graph(rawgraph)
+    measure_snapshots(snapshots, process, n_proc, db, collection, n_workers, max_in_flight, ordered,
+                      measures, approx, store, batch_size, flush_interval, instrument,
+                      None if ranges is None else RangeSweep(ranges, classes), graph_archive)
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import resource
+import threading
+
+REPORT_INTERVAL = 60.
+PROFILE_ROOT = "profiles/"
+
+
+def timed(sample, name, function, *args):
+    # sample is None when instrumentation is off, then this is a plain call.
+    # Stage CPU time is the calling thread's, so the writer thread is not
+    # charged to it (nor are threads the stage itself starts).
+    if sample is None:
+        return function(*args)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    result = function(*args)
+    before = sample.get(name, (0., 0.))
+    sample[name] = (before[0] + time.perf_counter() - wall, before[1] + time.thread_time() - cpu)
+    return result
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux; for RUSAGE_CHILDREN it is the largest
+    # child, so the two are reported apart and never summed.
+    return 1024 * resource.getrusage(who).ru_maxrss
+
+
+class Instrumentation(object):
+    def __init__(self, interval=REPORT_INTERVAL, jsonl=None, prometheus=None, profile_range=None,
+                 profile_dir=PROFILE_ROOT):
+        self.interval = interval
+        self.jsonl = jsonl
+        self.prometheus = prometheus
+        self.profile_range = profile_range
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.snapshots = 0
+        self.vehicles = 0
+        self.edges = 0
+        self.read = 0
+        self.busy = 0.
+        self.n_workers = 1
+        self.writer = None
+        self.started = None
+        self.cpu_started = None
+        self.last_report = time.time()
+
+    def start(self, writer=None, n_workers=1):
+        # Called by the run once it is set up, elapsed time and process CPU time count from here.
+        self.writer = writer
+        self.n_workers = n_workers
+        self.started = self.last_report = time.time()
+        self.cpu_started = time.process_time()
+
+    def profile(self):
+        # (start, end, directory) for the workers, snapshots are selected by simulation time.
+        if self.profile_range is None:
+            return None
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        return self.profile_range[0], self.profile_range[1], self.profile_dir
+
+    def record(self, name, wall, cpu, calls=1):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0., 0., 0.])
+            stage[0] += calls
+            stage[1] += wall
+            stage[2] += cpu
+            stage[3] = max(stage[3], wall)
+
+    def iterate(self, name, items):
+        items = iter(items)
+        while True:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            self.record(name, time.perf_counter() - wall, time.thread_time() - cpu)
+            self.read += 1
+            yield item
+
+    def add_sample(self, sample, duration, data):
+        for name, value in sample.items():
+            if isinstance(value, tuple):
+                self.record(name, *value)
+        with self.lock:
+            self.snapshots += 1
+            self.busy += duration
+            if data:
+                self.vehicles += data["n_vehicle"]
+            self.edges += sample.get("n_edges", 0)
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def summary(self):
+        now = time.time()
+        elapsed = now - self.started if self.started is not None else 0.
+        process_cpu = time.process_time() - self.cpu_started if self.cpu_started is not None else 0.
+        with self.lock:
+            stages = dict((name, dict(calls=s[0], wall=s[1], thread_cpu=s[2], max_wall=s[3]))
+                          for name, s in self.stages.items())
+            return dict(
+                time=now,
+                elapsed=elapsed,
+                process_cpu=process_cpu,
+                snapshots=self.snapshots,
+                vehicles=self.vehicles,
+                edges=self.edges,
+                in_flight=self.read - self.snapshots,
+                writer_queue=self.writer.pending.qsize() if self.writer is not None else 0,
+                worker_utilization=self.busy / (elapsed * self.n_workers) if elapsed > 0 else 0.,
+                peak_rss_bytes=peak_rss(),
+                children_peak_rss_bytes=peak_rss(resource.RUSAGE_CHILDREN),
+                stages=stages
+            )
+
+    def report(self):
+        summary = self.summary()
+        self.last_report = summary["time"]
+        if self.jsonl:
+            with open(self.jsonl, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+        if self.prometheus:
+            # Replaced atomically, as node_exporter's textfile collector expects.
+            with open(self.prometheus + ".tmp", "w") as f:
+                f.write(prometheus_text(summary))
+            os.replace(self.prometheus + ".tmp", self.prometheus)
+        return summary
+
+def prometheus_text(summary):
+    lines = []
+    for name, kind, key in (("gvr_elapsed_seconds", "gauge", "elapsed"),
+                            ("gvr_process_cpu_seconds_total", "counter", "process_cpu"),
+                            ("gvr_snapshots_total", "counter", "snapshots"),
+                            ("gvr_vehicles_total", "counter", "vehicles"),
+                            ("gvr_edges_total", "counter", "edges"),
+                            ("gvr_in_flight", "gauge", "in_flight"),
+                            ("gvr_writer_queue", "gauge", "writer_queue"),
+                            ("gvr_worker_utilization", "gauge", "worker_utilization"),
+                            ("gvr_peak_rss_bytes", "gauge", "peak_rss_bytes"),
+                            ("gvr_children_peak_rss_bytes", "gauge", "children_peak_rss_bytes")):
+        lines.append("# TYPE %s %s"%(name, kind))
+        lines.append("%s %s"%(name, summary[key]))
+    lines.append("# TYPE gvr_stage_calls_total counter")
+    for stage, s in sorted(summary["stages"].items()):
+        lines.append('gvr_stage_calls_total{stage="%s"} %s'%(stage, s["calls"]))
+    lines.append("# TYPE gvr_stage_seconds_total counter")
+    for stage, s in sorted(summary["stages"].items()):
+        lines.append('gvr_stage_seconds_total{stage="%s",clock="wall"} %r'%(stage, s["wall"]))
+        lines.append('gvr_stage_seconds_total{stage="%s",clock="thread_cpu"} %r'%(stage, s["thread_cpu"]))
+    return "\n".join(lines) + "\n"
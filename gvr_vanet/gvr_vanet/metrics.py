@@ -0,0 +1,325 @@
+import math
+
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import sparse
+from scipy.sparse import csgraph
+
+MEASURES = ("degree", "closeness", "betweenness", "pagerank", "harmonic",
+            "local_efficiency", "global_efficiency", "maximal_matching")
+PATH_MEASURES = ("closeness", "betweenness", "harmonic", "global_efficiency")
+DEFAULT_MEASURES = ("degree",)
+# Upper bound on the entries of the dense (sources x arcs) BFS blocks.
+BFS_BLOCK_SIZE = 1 << 22
+APPROX_DELTA = 0.1
+
+
+def adjacency(n_nodes, edges):
+    senders = np.asarray(edges['f0'], dtype=np.int32)
+    receivers = np.asarray(edges['f1'], dtype=np.int32)
+    rows = np.concatenate((senders, receivers))
+    cols = np.concatenate((receivers, senders))
+    data = np.ones(len(rows), dtype=np.float64)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(n_nodes, n_nodes))
+
+def density(adj):
+    n = adj.shape[0]
+    if n <= 1:
+        return 0.0
+    return adj.nnz / (n * (n - 1))
+
+def degree_centrality(adj):
+    n = adj.shape[0]
+    if n <= 1:
+        return np.ones(n)
+    return np.diff(adj.indptr) / (n - 1)
+
+def bfs_block(adj, sources):
+    # Hop distances come from scipy's BFS; the arcs u -> v with
+    # dist(v) == dist(u) + 1 form each source's shortest-path DAG, grouped by the
+    # level of v, and path counts are pushed along them one level at a time.
+    n, b = adj.shape[0], len(sources)
+    dist = csgraph.shortest_path(adj, unweighted=True, directed=True, indices=sources)
+    dist[np.isinf(dist)] = -1
+    # Distances are below the vehicle count, so small components use a narrower type.
+    dist = dist.astype(np.int16 if n < np.iinfo(np.int16).max else np.int32)
+    rows = np.repeat(np.arange(n), np.diff(adj.indptr))
+    upper = rows < adj.indices
+    a, c = rows[upper], adj.indices[upper]
+    dist_a, dist_c = dist[:, a], dist[:, c]
+    forward = np.nonzero((dist_c == dist_a + 1) & (dist_a >= 0))
+    backward = np.nonzero((dist_a == dist_c + 1) & (dist_c >= 0))
+    src = np.concatenate((forward[0], backward[0]))
+    tails = np.concatenate((a[forward[1]], c[backward[1]]))
+    heads = np.concatenate((c[forward[1]], a[backward[1]]))
+    level = dist[src, heads]
+    order = np.argsort(level.astype(np.uint16) if n < np.iinfo(np.uint16).max else level, kind="stable")
+    src, tails, heads, level = src[order], tails[order], heads[order], level[order]
+    bounds = np.searchsorted(level, np.arange(1, level.max() + 2 if len(level) else 1))
+    u = src * n + tails
+    v = src * n + heads
+    levels = [(u[start:stop], v[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    sigma = np.zeros(b * n)
+    sigma[np.arange(b) * n + sources] = 1.0
+    for u_level, v_level in levels:
+        np.add.at(sigma, v_level, sigma[u_level])
+    return dist, sigma, levels
+
+def block_dependencies(sigma, levels, sources):
+    # Brandes accumulation over the DAG levels, deepest first.
+    n = len(sigma) // len(sources)
+    delta = np.zeros_like(sigma)
+    for u_level, v_level in reversed(levels):
+        np.add.at(delta, u_level, sigma[u_level] / sigma[v_level] * (1.0 + delta[v_level]))
+    delta[np.arange(len(sources)) * n + sources] = 0.0
+    return delta.reshape(len(sources), n).sum(axis=0)
+
+def path_measures(adj, measures=PATH_MEASURES, sources=None):
+    # Sums over the given sources of each vehicle's distances, inverse distances
+    # and Brandes dependencies; distances are symmetric, so with every vehicle as
+    # source these are the vehicle's own totals.
+    n = adj.shape[0]
+    sources = np.arange(n) if sources is None else np.asarray(sources)
+    count = np.zeros(n)
+    dist_sum = np.zeros(n)
+    harmonic_sum = np.zeros(n)
+    betweenness_sum = np.zeros(n)
+    step = max(1, BFS_BLOCK_SIZE // max(adj.nnz, n, 1))
+    for start in range(0, len(sources), step):
+        block = sources[start:start + step]
+        dist, sigma, levels = bfs_block(adj, block)
+        found = dist > 0
+        count += found.sum(axis=0)
+        dist_sum += np.where(found, dist, 0).sum(axis=0)
+        with np.errstate(divide="ignore"):
+            harmonic_sum += np.where(found, 1.0 / dist, 0.0).sum(axis=0)
+        if "betweenness" in measures:
+            betweenness_sum += block_dependencies(sigma, levels, block)
+    return count, dist_sum, harmonic_sum, betweenness_sum
+
+def approx_samples(samples=None, epsilon=None, delta=APPROX_DELTA):
+    if samples:
+        return int(samples)
+    if not epsilon:
+        raise ValueError("Approximate measures need a sample budget or a target error.")
+    # Hoeffding bound for a mean of values in [0, 1].
+    return int(math.ceil(math.log(2.0 / delta) / (2.0 * epsilon ** 2)))
+
+def pivot_quota(sizes, samples):
+    # The budget is split in proportion to component size among the components
+    # with more than two vehicles; those no larger than their share are computed
+    # exactly and the rest of the budget is split again among the others. The
+    # remainder goes by largest fraction, so the quotas sum to the budget. With
+    # fewer pivots than components, the largest components get one each.
+    quota = np.where(sizes > 2, 0, sizes).astype(np.int64)
+    active = sizes > 2
+    budget = samples
+    while active.any():
+        share = budget * sizes / sizes[active].sum()
+        exact = active & (sizes <= share)
+        if not exact.any():
+            break
+        quota[exact] = sizes[exact]
+        budget -= int(sizes[exact].sum())
+        active &= ~exact
+    if active.any() and budget > 0:
+        components = np.flatnonzero(active)
+        if budget < len(components):
+            quota[components[np.argsort(-sizes[components], kind="stable")[:budget]]] = 1
+        else:
+            share = 1 + (budget - len(components)) * sizes[components] / sizes[components].sum()
+            quota[components] = np.floor(share)
+            left = budget - int(quota[components].sum())
+            quota[components[np.argsort(np.floor(share) - share, kind="stable")[:left]]] += 1
+    return quota
+
+def sample_pivots(comp, samples, seed=None):
+    # Stratified by component, so every vehicle is estimated from pivots of its
+    # own component.
+    n = len(comp)
+    sizes = np.bincount(comp)
+    quota = pivot_quota(sizes, samples)
+    order = np.lexsort((np.random.default_rng(seed).random(n), comp))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    rank = np.arange(n) - starts[comp[order]]
+    pivots = np.sort(order[(rank < quota[comp[order]]) & (sizes[comp[order]] > 2)])
+    return pivots, quota
+
+def component_tasks(adj, comp, sizes, pivots):
+    # One task per block of pivots of each component with more than two vehicles,
+    # largest components first so they do not end up last on a busy pool.
+    is_pivot = np.zeros(adj.shape[0], dtype=bool)
+    is_pivot[pivots] = True
+    members_of = np.argsort(comp, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+    tasks = []
+    for c in np.argsort(-sizes, kind="stable"):
+        size = int(sizes[c])
+        if size <= 2:
+            break
+        members = members_of[starts[c]:starts[c] + size]
+        sub = adj[members][:, members]
+        sources = np.flatnonzero(is_pivot[members])
+        step = max(1, BFS_BLOCK_SIZE // max(sub.nnz, size))
+        for start in range(0, len(sources), step):
+            tasks.append((members, sub, sources[start:start + step]))
+    return tasks
+
+def estimate_paths(adj, measures=PATH_MEASURES, approx=None, n_jobs=1):
+    n = adj.shape[0]
+    n_comp, comp = csgraph.connected_components(adj, directed=False)
+    sizes = np.bincount(comp, minlength=n_comp).astype(np.float64)
+    info = {}
+    if approx is None:
+        pivots, quota = np.arange(n), sizes
+    else:
+        delta = approx.get("delta", APPROX_DELTA)
+        k = approx_samples(approx.get("samples"), approx.get("epsilon"), delta)
+        pivots, quota = sample_pivots(comp, k, approx.get("seed"))
+        # The Hoeffding bound of each sampled component, averaged over its vehicles.
+        sampled = (quota > 0) & (quota < sizes)
+        bound = np.sqrt(math.log(2.0 / delta) / (2.0 * quota[sampled]))
+        info["approx_samples"] = len(pivots)
+        info["approx_error"] = float(np.average(bound, weights=sizes[sampled])) if sampled.any() else 0.0
+        info["approx_unsampled"] = int(sizes[quota == 0].sum())
+
+    count = np.zeros(n)
+    dist_sum = np.zeros(n)
+    harmonic_sum = np.zeros(n)
+    betweenness_sum = np.zeros(n)
+    # Isolated vehicles keep zeros; the two vehicles of a pair are one hop apart
+    # and lie on no path between others.
+    pair = sizes[comp] == 2
+    count[pair] = dist_sum[pair] = harmonic_sum[pair] = 1.0
+    tasks = component_tasks(adj, comp, sizes, pivots)
+    results = Parallel(n_jobs=n_jobs)(delayed(path_measures)(sub, measures, sources) for _, sub, sources in tasks)
+    for (members, _, _), (c, d, h, b) in zip(tasks, results):
+        count[members] += c
+        dist_sum[members] += d
+        harmonic_sum[members] += h
+        betweenness_sum[members] += b
+
+    reach = sizes[comp] - 1
+    ratio = np.divide(reach, count, out=np.zeros(n), where=count > 0)
+    return reach, dist_sum * ratio, harmonic_sum * ratio, betweenness_sum * np.divide(sizes, quota, out=np.zeros(n_comp), where=quota > 0)[comp], info
+
+def closeness_from_paths(n, reach, totsp):
+    closeness = np.zeros(len(reach))
+    if n <= 1:
+        return closeness
+    mask = totsp > 0
+    closeness[mask] = (reach[mask] / totsp[mask]) * (reach[mask] / (n - 1))
+    return closeness
+
+def betweenness_scale(n):
+    return 1.0 / ((n - 1) * (n - 2)) if n > 2 else 1.0
+
+def pagerank(adj, alpha=0.85, max_iter=100, tol=1.0e-6):
+    n = adj.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    degree = np.diff(adj.indptr).astype(np.float64)
+    dangling = degree == 0
+    inv_degree = np.divide(1.0, degree, out=np.zeros(n), where=~dangling)
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        last = x
+        x = alpha * (adj @ (last * inv_degree) + last[dangling].sum() / n) + (1.0 - alpha) / n
+        if np.abs(x - last).sum() < n * tol:
+            break
+    return x
+
+def ego_efficiency(adj, vertices):
+    # The neighborhoods of the vertices as one dense batch of k x k adjacency
+    # matrices, k the largest degree among them; pairs are reached one hop at
+    # a time by a batched product with the neighborhood adjacency.
+    k = np.diff(adj.indptr)[vertices]
+    m = int(k.sum())
+    size = int(k.max())
+    owner = np.repeat(np.arange(len(vertices)), k)
+    first = np.concatenate(([0], np.cumsum(k)))
+    heads = adj.indices[np.repeat(adj.indptr[vertices] - first[:-1], k) + np.arange(m)]
+    arc_ids = sparse.csr_matrix((np.arange(1, m + 1, dtype=np.float64), heads, first), shape=(len(vertices), adj.shape[0]))
+    # Arc p = (v, i) meets arc q = (v, j) when j is also a neighbor of i.
+    shared = arc_ids[owner].multiply(adj[heads]).tocoo()
+    p = shared.row
+    q = shared.data.astype(np.int64) - 1
+    ego = np.zeros((len(vertices), size, size), dtype=np.float32)
+    ego[owner[p], p - first[owner[p]], q - first[owner[p]]] = 1.0
+    reached = ego + np.eye(size, dtype=np.float32)
+    frontier = ego
+    inverse_sum = ego.sum(axis=(1, 2), dtype=np.float64)
+    hops = 1
+    while True:
+        hops += 1
+        frontier = np.matmul(frontier, ego)
+        frontier = ((frontier > 0) & (reached == 0)).astype(np.float32)
+        found = frontier.sum(axis=(1, 2), dtype=np.float64)
+        if not found.any():
+            break
+        inverse_sum += found / hops
+        reached += frontier
+    return inverse_sum / (k * (k - 1))
+
+def local_efficiency(adj):
+    # Vertices are batched by degree, at most BFS_BLOCK_SIZE neighbor pairs at a time.
+    n = adj.shape[0]
+    efficiency = np.zeros(n)
+    degree = np.diff(adj.indptr)
+    vertices = np.flatnonzero(degree >= 2)
+    vertices = vertices[np.argsort(degree[vertices], kind="stable")]
+    start = 0
+    while start < len(vertices):
+        pairs = np.arange(1, len(vertices) - start + 1) * degree[vertices[start:]].astype(np.int64) ** 2
+        stop = start + max(1, int(np.searchsorted(pairs, BFS_BLOCK_SIZE, side="right")))
+        efficiency[vertices[start:stop]] = ego_efficiency(adj, vertices[start:stop])
+        start = stop
+    return efficiency
+
+def maximal_matching(adj):
+    # Greedy matching in edge order, computed in rounds: an edge whose index is
+    # the smallest left at both endpoints is the one the sequential scan takes.
+    n = adj.shape[0]
+    upper = sparse.triu(adj, k=1).tocoo()
+    order = np.lexsort((upper.col, upper.row))
+    u, v = upper.row[order], upper.col[order]
+    matched = np.zeros(n, dtype=bool)
+    remaining = np.arange(len(u))
+    while len(remaining):
+        best = np.full(n, len(u))
+        np.minimum.at(best, u[remaining], remaining)
+        np.minimum.at(best, v[remaining], remaining)
+        chosen = remaining[(best[u[remaining]] == remaining) & (best[v[remaining]] == remaining)]
+        matched[u[chosen]] = True
+        matched[v[chosen]] = True
+        remaining = remaining[~(matched[u[remaining]] | matched[v[remaining]])]
+    return matched.astype(np.float64)
+
+def centralities(adj, measures=DEFAULT_MEASURES, approx=None, n_jobs=1):
+    unknown = set(measures) - set(MEASURES)
+    if unknown:
+        raise ValueError("Unknown measures %s, use any of %s."%(sorted(unknown), MEASURES))
+    n = adj.shape[0]
+    results = {}
+    if "degree" in measures:
+        results["degree"] = degree_centrality(adj)
+    if any(m in measures for m in PATH_MEASURES):
+        reach, totsp, harmonic, betweenness, info = estimate_paths(adj, measures, approx, n_jobs)
+        results.update(info)
+        if "closeness" in measures:
+            results["closeness"] = closeness_from_paths(n, reach, totsp)
+        if "betweenness" in measures:
+            results["betweenness"] = betweenness * betweenness_scale(n)
+        if "harmonic" in measures:
+            results["harmonic"] = harmonic
+        if "global_efficiency" in measures:
+            # Nodal efficiency: its mean over the vehicles is the global efficiency.
+            results["global_efficiency"] = harmonic / (n - 1) if n > 1 else np.zeros(n)
+    if "pagerank" in measures:
+        results["pagerank"] = pagerank(adj)
+    if "local_efficiency" in measures:
+        results["local_efficiency"] = local_efficiency(adj)
+    if "maximal_matching" in measures:
+        results["maximal_matching"] = maximal_matching(adj)
+    return results
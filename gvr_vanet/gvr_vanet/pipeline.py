@@ -0,0 +1,31 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+from joblib import cpu_count
+
+
+def run_pipeline(items, worker, commit, n_workers=None, max_in_flight=None, ordered=True):
+    n_workers = cpu_count() if not n_workers else n_workers
+    max_in_flight = 2 * n_workers if not max_in_flight else max_in_flight
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1, got %s."%(max_in_flight))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        if ordered:
+            pending = deque()
+            for item in items:
+                if len(pending) >= max_in_flight:
+                    commit(pending.popleft().result())
+                pending.append(executor.submit(worker, item))
+            while pending:
+                commit(pending.popleft().result())
+        else:
+            pending = set()
+            for item in items:
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        commit(future.result())
+                pending.add(executor.submit(worker, item))
+            for future in as_completed(pending):
+                commit(future.result())
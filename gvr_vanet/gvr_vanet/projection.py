@@ -0,0 +1,79 @@
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+from .graph import parse_lines
+from .trace import is_trace, open_writer, read_snapshots
+
+NO_PROJECTION = "!"
+
+
+class NetProjection(object):
+    def __init__(self, net_offset=(0.0, 0.0), proj_parameter=NO_PROJECTION):
+        self.net_offset = np.array(net_offset, dtype=np.float64)
+        self.proj_parameter = proj_parameter
+        self.proj = None
+        if proj_parameter != NO_PROJECTION:
+            if pyproj is None:
+                raise ImportError("pyproj is required to convert coordinates of networks projected with '%s'."%(proj_parameter))
+            self.proj = pyproj.Proj(proj_parameter)
+
+    @classmethod
+    def from_net(cls, net_file):
+        # The location element comes first in a .net.xml, so stop parsing there.
+        for _, element in ET.iterparse(net_file, events=("start",)):
+            if element.tag == "location":
+                offset = [float(v) for v in element.get("netOffset", "0,0").split(",")]
+                return cls(offset, element.get("projParameter", NO_PROJECTION))
+        raise ValueError("%s has no location element."%(net_file))
+
+    @classmethod
+    def from_sumocfg(cls, sumocfg):
+        for _, element in ET.iterparse(sumocfg, events=("start",)):
+            if element.tag in ("net-file", "n"):
+                net_file = element.get("value").split(",")[0]
+                return cls.from_net(os.path.join(os.path.dirname(sumocfg), net_file))
+        raise ValueError("%s does not declare a net-file."%(sumocfg))
+
+    def to_geo(self, pos):
+        pos = np.asarray(pos, dtype=np.float64) - self.net_offset
+        if self.proj is None:
+            return pos
+        lon, lat = self.proj(pos[:, 0], pos[:, 1], inverse=True)
+        return np.column_stack((lon, lat))
+
+    def from_geo(self, geo):
+        geo = np.asarray(geo, dtype=np.float64)
+        if self.proj is not None:
+            x, y = self.proj(geo[:, 0], geo[:, 1])
+            geo = np.column_stack((x, y))
+        return geo + self.net_offset
+
+    def normalize(self, pos):
+        # Same round trip as convertGeo(x, y) followed by convertGeo(lon, lat, fromGeo=True).
+        return self.from_geo(self.to_geo(pos))
+
+
+def load_projection(net):
+    if isinstance(net, NetProjection):
+        return net
+    if net.endswith(".sumocfg"):
+        return NetProjection.from_sumocfg(net)
+    return NetProjection.from_net(net)
+
+def reproject_trace(rawgraph, output, net, trace_format=None):
+    projection = load_projection(net)
+    binary = is_trace(rawgraph)
+    trace_format = ("binary" if binary else "dat") if trace_format is None else trace_format
+    n_snapshots = 0
+    with open_writer(output, trace_format) as writer:
+        for snapshot in read_snapshots(rawgraph):
+            time, ids, pos = snapshot if binary else parse_lines(snapshot)
+            writer.write(time, ids, projection.normalize(pos))
+            n_snapshots += 1
+    return n_snapshots
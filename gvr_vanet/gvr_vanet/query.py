@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+from .cube import LEVELS, bucket_range, bucket_width, rhythm_cells
+from .store import STORE_PATH, MetricsStore
+
+CACHE_SIZE = 32
+
+
+def cell_series(cells):
+    # Per-bucket vehicles per snapshot, mean and maximum of a window of rhythm cells.
+    return (cells['time'] / 60. / 60., cells['count'] / cells['n_snapshots'],
+            cells['sum'] / cells['count'], cells['max'])
+
+
+class RhythmQuery(object):
+    def __init__(self, path=STORE_PATH, cache_size=CACHE_SIZE):
+        self.store = MetricsStore(path)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def data_version(self):
+        # Changes whenever another connection commits to the store.
+        return self.store.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def cached(self, key, load, *args):
+        version = self.data_version()
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+        value = load(*args)
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+    def window(self, measure, start, end, interval):
+        return self.cached((measure, start, end, interval), self.load, measure, start, end, interval)
+
+    def raster(self, measure, start, end):
+        return self.cached((measure, start, end, "raster"), self.store.load_raster, measure, start, end)
+
+    def load(self, measure, start, end, interval):
+        if interval in LEVELS:
+            return self.store.load_rhythm(measure, int(interval), start, end)
+        # Intervals outside the precomputed levels are aggregated from the raw rows.
+        rows = self.store.load(measure, start, end)
+        cells = rhythm_cells(measure, rows['time'], rows['value'], interval)
+        first, last = bucket_range(start, end, bucket_width(interval))
+        return cells[(cells['bucket'] >= first) & (cells['bucket'] <= last)]
+
+    def close(self):
+        self.store.close()
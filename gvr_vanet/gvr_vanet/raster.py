@@ -0,0 +1,60 @@
+import numpy as np
+
+from .cube import bin_edges, normalize, value_bins
+
+RASTER_SECONDS = 60.
+RASTER_BINS = 256
+COUNT_DTYPE = np.dtype('<u4')
+
+
+class RhythmRaster(object):
+    # Vehicle counts on a time column x value pixel grid, filled one snapshot
+    # batch at a time, so drawing costs the pixels and not the samples.
+    def __init__(self, measure, first=0, counts=None, bins=RASTER_BINS, seconds=RASTER_SECONDS):
+        self.measure = measure
+        self.first = first
+        self.bins = bins
+        self.seconds = seconds
+        self.counts = np.zeros((0, bins), dtype=COUNT_DTYPE) if counts is None else counts
+
+    def columns(self):
+        return self.first + np.arange(len(self.counts))
+
+    def grow(self, first, last):
+        if len(self.counts) == 0:
+            self.first = first
+            self.counts = np.zeros((last - first + 1, self.bins), dtype=COUNT_DTYPE)
+            return
+        start = min(first, self.first)
+        stop = max(last, self.first + len(self.counts) - 1)
+        if start == self.first and stop == self.first + len(self.counts) - 1:
+            return
+        counts = np.zeros((stop - start + 1, self.bins), dtype=COUNT_DTYPE)
+        counts[self.first - start:self.first - start + len(self.counts)] = self.counts
+        self.first = start
+        self.counts = counts
+
+    def add(self, times, values):
+        times = np.asarray(times, dtype=np.float64)
+        if len(times) == 0:
+            return
+        columns = np.floor(times / self.seconds).astype(np.int64)
+        self.grow(columns.min(), columns.max())
+        cells = (columns - self.first) * self.bins + value_bins(normalize(self.measure, times, values), self.bins)
+        self.counts += np.bincount(cells, minlength=self.counts.size).reshape(self.counts.shape).astype(COUNT_DTYPE)
+
+    def merge(self, other):
+        if len(other.counts) == 0:
+            return
+        self.grow(other.first, other.first + len(other.counts) - 1)
+        start = other.first - self.first
+        self.counts[start:start + len(other.counts)] += other.counts
+
+    def image(self, width=None):
+        # Column edges in hours, value edges and counts summed down to at most `width` columns.
+        counts = self.counts
+        step = 1 if not width or len(counts) <= width else -(-len(counts) // width)
+        if step > 1:
+            counts = np.add.reduceat(counts, np.arange(0, len(counts), step), axis=0)
+        x = (self.first + np.arange(0, len(self.counts) + step, step)[:len(counts) + 1]) * self.seconds / 60. / 60.
+        return x, bin_edges(self.bins), counts
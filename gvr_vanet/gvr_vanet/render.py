@@ -0,0 +1,200 @@
+import io
+import base64
+import queue
+import threading
+
+import numpy as np
+from matplotlib import cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from .cube import MIN_VALUE, bin_edges, bucket_width, size_normalized
+from .query import RhythmQuery, cell_series
+
+
+def get_color(color):
+    if color == "cool":
+        return cm.cool
+    elif color == "inferno":
+        return cm.inferno
+    elif color == "viridis":
+        return cm.viridis
+    elif color == "greys":
+        return cm.Greys
+    elif color == "purples":
+        return cm.Purples
+    elif color == "blues":
+        return cm.Blues
+    elif color == "plasma":
+        return cm.plasma
+    elif color == "spring":
+        return cm.spring
+    elif color == "summer":
+        return cm.summer
+    elif color == "winter":
+        return cm.winter
+    elif color == "autumn":
+        return cm.autumn
+    elif color == "wistia":
+        return cm.Wistia
+    elif color == "magma":
+        return cm.magma
+    elif color == "hot":
+        return cm.hot
+    elif color == "rainbow":
+        return cm.rainbow
+    elif color == "gist_rainbow":
+        return cm.gist_rainbow
+    elif color == "brg":
+        return cm.brg
+    elif color == "hsv":
+        return cm.hsv
+
+    return cm.plasma
+
+def rhythm_grid(cells, level):
+    # Regular time x value grid of the histograms, empty buckets included.
+    width = bucket_width(level)
+    first = cells['bucket'][0]
+    hist = np.zeros((cells['bucket'][-1] - first + 1, cells['hist'].shape[1]))
+    hist[cells['bucket'] - first] = cells['hist']
+    x = (first + np.arange(len(hist) + 1)) * width / 60. / 60.
+    return x, bin_edges(), hist
+
+def value_limits(y, hist):
+    occupied = np.flatnonzero(hist.sum(axis=0))
+    return y[occupied[0]], y[occupied[-1] + 1]
+
+def measure_label(measure):
+    label = measure if "pagerank" in measure else measure + " centrality"
+    if size_normalized(measure):
+        # The cells hold these measures divided by the snapshot size minus one.
+        label += " / (vehicles - 1)"
+    return label
+
+
+def gvr_figure(fig, cells, level, measure, color, raster=None):
+    x, y, hist = rhythm_grid(cells, level)
+    ax = fig.add_subplot(111)
+    mesh = ax.pcolormesh(x, y, hist.T / hist.sum(), cmap=get_color(color))
+    ax.set_ylim(*value_limits(y, hist))
+    ax.set_yscale('symlog', linthresh=MIN_VALUE)
+    ax.set_xlabel('time (h)')
+    ax.set_ylabel(measure_label(measure))
+    ax.grid(True)
+    fig.colorbar(mesh, ax=ax)
+
+def log_figure(fig, cells, level, measure, color, raster=None):
+    x, y, hist = rhythm_grid(cells, level)
+    ax = fig.add_subplot(111)
+    mesh = ax.pcolormesh(x, y, np.ma.log10(np.ma.masked_equal(hist.T, 0)), cmap=get_color(color))
+    ax.axis([x[0], x[-1]] + list(value_limits(y, hist)))
+    ax.set_yscale('symlog', linthresh=MIN_VALUE)
+    ax.set_xlabel('time (h)')
+    ax.set_ylabel(measure_label(measure))
+    cb = fig.colorbar(mesh, ax=ax)
+    cb.set_label('log10(N)')
+    ax.grid(True)
+
+def scatter_figure(fig, cells, level, measure, color, raster=None):
+    ax = fig.add_subplot(111)
+    if raster is None:
+        x, y, hist = rhythm_grid(cells, level)
+        # One marker per occupied time/value cell of the rhythm histograms.
+        cols, rows = np.nonzero(hist)
+        ax.plot((x[cols] + x[cols + 1]) / 2., (y[rows] + y[rows + 1]) / 2., 'o', markersize=4, alpha=0.5, color='purple')
+        ax.set_ylim(*value_limits(y, hist))
+    else:
+        # Density-shaded scatter: vehicles are summed into at most one column per pixel.
+        x, y, counts = raster.image(int(fig.bbox.width))
+        mesh = ax.pcolormesh(x, y, np.ma.log10(np.ma.masked_equal(counts.T, 0)), cmap=get_color(color))
+        ax.set_ylim(*value_limits(y, counts))
+        cb = fig.colorbar(mesh, ax=ax)
+        cb.set_label('log10(N)')
+    ax.set_xlabel('time (h)')
+    ax.set_ylabel(measure_label(measure))
+    ax.set_yscale('symlog', linthresh=MIN_VALUE)
+    ax.grid(True)
+
+def stem_figure(fig, x, values, ylabel):
+    ax = fig.add_subplot(111)
+    ax.stem(x, values)
+    ax.set_xlabel('time (h)')
+    ax.set_ylabel(ylabel)
+    ax.grid(True)
+
+def mean_figure(fig, cells, level, measure, color, raster=None):
+    time, _, mean, _ = cell_series(cells)
+    stem_figure(fig, time, mean, "Mean " + measure_label(measure))
+
+def max_figure(fig, cells, level, measure, color, raster=None):
+    time, _, _, maximum = cell_series(cells)
+    stem_figure(fig, time, maximum, "Maximum " + measure_label(measure))
+
+def vehicles_figure(fig, cells, level, measure, color, raster=None):
+    time, vehicles, _, _ = cell_series(cells)
+    stem_figure(fig, time, vehicles, "Number of vehicles")
+
+# In the order of the interface tabs.
+FIGURES = (gvr_figure, log_figure, mean_figure, max_figure, scatter_figure, vehicles_figure)
+FIGURE_NAMES = ("gvr", "gvr-log", "mean", "max", "scatter", "vehicles")
+SCATTER = FIGURE_NAMES.index("scatter")
+
+def draw(index, cells, level, measure, color, raster=None):
+    # Figures are drawn with the object API, so no pyplot state is shared with the Tk thread.
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    FIGURES[index](fig, cells, level, measure, color, raster)
+    return fig
+
+def render(index, cells, level, measure, color, raster=None):
+    fig = draw(index, cells, level, measure, color, raster)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return fig, base64.b64encode(buffer.getvalue())
+
+
+class RenderWorker(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.active = 0
+        self.thread = threading.Thread(target=self.run, name="gvr-render")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, measure, start, end, level, color):
+        # Bumping the generation cancels whatever is still being rendered.
+        self.generation += 1
+        self.jobs.put((self.generation, measure, start, end, level, color))
+        return self.generation
+
+    def run(self):
+        # The store connection lives in this thread, so loads never block the mainloop.
+        query = RhythmQuery() if self.path is None else RhythmQuery(self.path)
+        while True:
+            job = self.jobs.get()
+            while not self.jobs.empty():
+                job = self.jobs.get_nowait()
+            generation, measure, start, end, level, color = job
+            try:
+                cells = query.window(measure, start, end, level)
+            except Exception as e:
+                self.results.put((generation, None, e))
+                continue
+            if len(cells) == 0:
+                self.results.put((generation, None, None))
+                continue
+            # The selected tab goes first, the others follow unless a newer job arrives.
+            pending = list(range(len(FIGURES)))
+            while pending and generation == self.generation:
+                index = self.active if self.active in pending else pending[0]
+                pending.remove(index)
+                try:
+                    raster = query.raster(measure, start, end) if index == SCATTER else None
+                    self.results.put((generation, index, render(index, cells, level, measure, color, raster)))
+                except Exception as e:
+                    self.results.put((generation, None, e))
+                    break
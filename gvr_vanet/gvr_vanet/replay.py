@@ -0,0 +1,132 @@
+import sys
+import pickle
+import argparse
+
+import numpy as np
+
+from .sampler import sample_simulation
+
+# TraCI domains whose calls are recorded, the others are forwarded untouched.
+DOMAINS = ("simulation", "vehicle")
+
+# A recording is a pickle stream of (domain, method, arguments, result) tuples,
+# arguments being (args, sorted keyword items), one per call in the order the
+# collector made them, with domain None for calls on the connection itself
+# (simulationStep, close).
+
+
+class RecordedDomain(object):
+    def __init__(self, recorder, name, domain):
+        self.recorder = recorder
+        self.name = name
+        self.domain = domain
+
+    def __getattr__(self, method):
+        return self.recorder.wrap(self.name, method, getattr(self.domain, method))
+
+
+class RecordingConnection(object):
+    # Wraps a live TraCI connection and writes every response to `path`.
+    def __init__(self, conn, path):
+        self.conn = conn
+        self.file = open(path, "wb")
+
+    def wrap(self, domain, method, function):
+        def call(*args, **kwargs):
+            result = function(*args, **kwargs)
+            pickle.dump((domain, method, (args, tuple(sorted(kwargs.items()))), result), self.file,
+                        pickle.HIGHEST_PROTOCOL)
+            return result
+        return call
+
+    def __getattr__(self, name):
+        if name in DOMAINS:
+            return RecordedDomain(self, name, getattr(self.conn, name))
+        return self.wrap(None, name, getattr(self.conn, name))
+
+    def close(self):
+        try:
+            self.wrap(None, "close", self.conn.close)()
+        finally:
+            self.file.close()
+
+
+class ReplayedDomain(object):
+    def __init__(self, replay, name):
+        self.replay = replay
+        self.name = name
+
+    def __getattr__(self, method):
+        return lambda *args, **kwargs: self.replay.respond(self.name, method, args, kwargs)
+
+
+class ReplayConnection(object):
+    # Stand-in for a TraCI connection answering from a recording, it fails as
+    # soon as the collector makes a call that differs from the recorded one.
+    def __init__(self, path):
+        self.calls = []
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    self.calls.append(pickle.load(f))
+                except EOFError:
+                    break
+        self.position = 0
+
+    def respond(self, domain, method, args, kwargs):
+        arguments = (args, tuple(sorted(kwargs.items())))
+        if self.position >= len(self.calls):
+            raise ValueError("Call %s.%s%s after the end of the recording."%(domain, method, arguments))
+        expected = self.calls[self.position]
+        if expected[:3] != (domain, method, arguments):
+            raise ValueError("Call %s %s.%s%s, recorded %s.%s%s."%(
+                self.position, domain, method, arguments, expected[0], expected[1], expected[2]))
+        self.position += 1
+        return expected[3]
+
+    def remaining(self):
+        return len(self.calls) - self.position
+
+    def __getattr__(self, name):
+        if name in DOMAINS:
+            return ReplayedDomain(self, name)
+        return lambda *args, **kwargs: self.respond(None, name, args, kwargs)
+
+
+def record_simulation(sumocfg, path, minutes=10, tripinfo="trip_info.xml", collect="polling", net=None):
+    # sumorunner exits without SUMO_HOME, so it is only imported to record.
+    from .sumorunner import traci
+    traci.start(["sumo", "-c", sumocfg, "--tripinfo-output", tripinfo], label="record")
+    conn = RecordingConnection(traci.getConnection("record"), path)
+    return [(t, np.array(ids), np.array(pos)) for t, ids, pos in
+            sample_simulation(sumocfg, minutes, tripinfo, collect=collect, conn=conn, net=net)]
+
+def replay_simulation(path, minutes=10, collect="polling", net=None):
+    conn = ReplayConnection(path)
+    samples = [(t, np.array(ids), np.array(pos)) for t, ids, pos in
+               sample_simulation(None, minutes, collect=collect, conn=conn, net=net)]
+    if conn.remaining():
+        raise ValueError("%s recorded calls were not replayed."%(conn.remaining()))
+    return samples
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record a TraCI session or replay it through a collector.")
+    parser.add_argument("command", choices=("record", "replay"))
+    parser.add_argument("recording")
+    parser.add_argument("--sumocfg", default=None, help="scenario to record")
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--collect", default="polling", choices=("polling", "subscription"))
+    parser.add_argument("--net", default=None)
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        if args.sumocfg is None:
+            parser.error("record needs --sumocfg")
+        samples = record_simulation(args.sumocfg, args.recording, args.minutes, collect=args.collect, net=args.net)
+    else:
+        samples = replay_simulation(args.recording, args.minutes, args.collect, args.net)
+    for t, ids, pos in samples:
+        print("%s %s vehicles"%(t, len(ids)))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
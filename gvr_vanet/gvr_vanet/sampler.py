@@ -0,0 +1,116 @@
+import logging
+
+import numpy as np
+
+from .projection import load_projection
+
+# Collectors only talk to the connection they are given, so replaying a
+# recording needs neither SUMO_HOME nor traci. traci is imported when a
+# simulation is started here or its constants are needed.
+
+
+def traci_constants():
+    try:
+        import traci.constants as tc
+    except ImportError:
+        # sumorunner puts $SUMO_HOME/tools on the path, or exits explaining how to set it.
+        from .sumorunner import tc
+    return tc
+
+def poll_samples(conn, interval, last_read_time):
+    while conn.simulation.getMinExpectedNumber() > 0:
+        current_time = conn.simulation.getTime()
+        conn.simulationStep()
+        if current_time % interval == 0:
+            if current_time <= last_read_time:
+                yield current_time, None, None
+            else:
+                veh_ids = conn.vehicle.getIDList()
+                pos = np.empty((len(veh_ids), 2), dtype=np.float64)
+                for i, veh_id in enumerate(veh_ids):
+                    pos[i] = conn.vehicle.getPosition(veh_id)
+                yield current_time, veh_ids, pos
+
+def subscribed_samples(conn, interval, last_read_time):
+    # Time, departures and the stop condition arrive with every simulationStep
+    # response, and vehicle positions are read from the cached subscription
+    # results, so a sample costs no extra round trips. subscribe answers with
+    # the current values, so vehicles are in the results from their departure on.
+    tc = traci_constants()
+    conn.simulation.subscribe((tc.VAR_TIME, tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_MIN_EXPECTED_VEHICLES))
+    current_time = conn.simulation.getTime()
+    pending = conn.simulation.getMinExpectedNumber()
+    while pending > 0:
+        conn.simulationStep()
+        step = conn.simulation.getSubscriptionResults()
+        departed = step[tc.VAR_DEPARTED_VEHICLES_IDS]
+        for veh_id in departed:
+            conn.vehicle.subscribe(veh_id, (tc.VAR_POSITION,))
+        if current_time % interval == 0:
+            if current_time <= last_read_time:
+                yield current_time, None, None
+            else:
+                results = conn.vehicle.getAllSubscriptionResults()
+                veh_ids = [veh_id for veh_id in results if tc.VAR_POSITION in results[veh_id]]
+                positions = [results[veh_id][tc.VAR_POSITION] for veh_id in veh_ids]
+                yield current_time, veh_ids, np.array(positions, dtype=np.float64).reshape(-1, 2)
+        current_time = step[tc.VAR_TIME]
+        pending = step[tc.VAR_MIN_EXPECTED_VEHICLES]
+
+COLLECTORS = dict(polling=poll_samples, subscription=subscribed_samples)
+
+def sample_simulation(sumocfg, minutes=10, tripinfo="trip_info.xml", last_read_time=-1, file_logger=None,
+                      collect="polling", conn=None, net=None):
+    file_logger = logging.getLogger('Logger') if file_logger is None else file_logger
+    if collect not in COLLECTORS:
+        raise ValueError("Unknown collection mode %s, use one of %s."%(collect, sorted(COLLECTORS)))
+
+    seconds = 60
+    # milisseconds = 1000
+    minutes = minutes
+    interval = minutes * seconds# * milisseconds
+
+    # An already open connection (e.g. traci.connect to a replaying server) can be given instead.
+    if conn is None:
+        from .sumorunner import traci
+        traci.start(["sumo", "-c", sumocfg, "--tripinfo-output", tripinfo])
+        conn = traci
+
+    # With a network (.net.xml, .sumocfg or NetProjection) positions are
+    # normalized offline instead of through two convertGeo calls per vehicle.
+    projection = load_projection(net) if net is not None else None
+
+    n_graphs = 0
+    id_vehicle = 1
+    vehicles = {}
+    try:
+        for current_time, veh_ids, pos in COLLECTORS[collect](conn, interval, last_read_time):
+            if veh_ids is None:
+                file_logger.info(
+                    "Skip time %s."%(current_time))
+                continue
+            n_vehicles = 0
+            ids = np.empty(len(veh_ids), dtype=np.uint32)
+            if projection is not None:
+                pos = projection.normalize(pos)
+            for i, veh_id in enumerate(veh_ids):
+                if projection is None:
+                    x, y = pos[i]
+                    lon, lat = conn.simulation.convertGeo(x, y)
+                    pos[i] = conn.simulation.convertGeo(lon, lat, fromGeo=True)
+
+                if veh_id not in vehicles:
+                    index = id_vehicle
+                    id_vehicle += 1
+                    vehicles[veh_id] = index
+                    n_vehicles += 1
+                else:
+                    index = vehicles[veh_id]
+
+                ids[i] = index
+            n_graphs += 1
+            file_logger.info(
+                "Graph number %s was simulated at %s with %s new vehicles and size %s."%(n_graphs, current_time, n_vehicles, len(ids)))
+            yield current_time, ids, pos
+    finally:
+        conn.close()
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from joblib import cpu_count
+
+from .sampler import sample_simulation
+from .trace import open_writer
+
+SHARD_ROOT = "shards/"
+MANIFEST = "manifest.json"
+BASE_PORT = 8900
+# Resident memory of one SUMO run of the Cologne scenario plus its sampler, in megabytes.
+MEMORY_PER_RUN = 2048
+SEEDS = (42,)
+MINUTES = (10.,)
+WINDOWS = (None,)
+
+
+def save_json(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def load_json(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def available_memory():
+    # In megabytes, None where the platform does not report it.
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2.**20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def max_jobs(jobs=None, memory_per_run=MEMORY_PER_RUN):
+    limit = cpu_count()
+    memory = available_memory()
+    if memory is not None and memory_per_run:
+        limit = min(limit, int(memory // memory_per_run))
+    if jobs:
+        limit = min(limit, jobs)
+    return max(limit, 1)
+
+def scenario_name(sumocfg, seed, minutes, window):
+    name = "%s_seed%s_%gmin"%(os.path.splitext(os.path.basename(sumocfg))[0], seed, minutes)
+    if window is not None:
+        name += "_%g-%gh"%window
+    return name
+
+def plan_scenarios(configs, seeds=SEEDS, minutes=MINUTES, windows=WINDOWS, base_port=BASE_PORT):
+    scenarios = []
+    for i, (sumocfg, seed, interval, window) in enumerate(itertools.product(configs, seeds, minutes, windows)):
+        scenarios.append(dict(name=scenario_name(sumocfg, seed, interval, window), sumocfg=os.path.abspath(sumocfg),
+                              seed=seed, minutes=interval, window=window, port=base_port + i))
+    return scenarios
+
+def sumo_command(scenario, tripinfo, binary="sumo"):
+    command = [binary, "-c", scenario["sumocfg"], "--tripinfo-output", tripinfo, "--seed", str(scenario["seed"])]
+    if scenario["window"] is not None:
+        begin, end = scenario["window"]
+        command += ["--begin", "%g"%(begin * 60. * 60.), "--end", "%g"%(end * 60. * 60.)]
+    return command
+
+def shard_logger(name, path):
+    file_logger = logging.getLogger("Logger.%s"%(name))
+    file_logger.setLevel(logging.DEBUG)
+    file_logger.propagate = False
+    if not file_logger.handlers:
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        file_logger.addHandler(handler)
+    return file_logger
+
+def run_scenario(scenario, root=SHARD_ROOT, trace_format="dat", collect="polling", net=None, binary="sumo"):
+    # sumorunner exits without SUMO_HOME and puts traci on the path, so it is only imported by the workers.
+    from .sumorunner import traci
+
+    path = os.path.join(root, scenario["name"])
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    trace = os.path.join(path, "raw_graph.%s"%("gvrt" if trace_format == "binary" else "dat"))
+    tripinfo = os.path.join(path, "trip_info.xml")
+    # Trace writers append, so a shard left by a failed run starts over.
+    for name in (trace, trace + ".idx"):
+        if os.path.isfile(name):
+            os.remove(name)
+    manifest = dict(scenario, trace=os.path.basename(trace), tripinfo=os.path.basename(tripinfo),
+                    trace_format=trace_format, status="running", started=time.time(), snapshots=0,
+                    first_time=None, last_time=None, error=None)
+    save_json(os.path.join(path, MANIFEST), manifest)
+
+    file_logger = shard_logger(scenario["name"], os.path.join(path, "run_sumo.log"))
+    try:
+        traci.start(sumo_command(scenario, tripinfo, binary), port=scenario["port"], label=scenario["name"])
+        conn = traci.getConnection(scenario["name"])
+        with open_writer(trace, trace_format) as writer:
+            for current_time, ids, pos in sample_simulation(None, scenario["minutes"], tripinfo, -1, file_logger,
+                                                            collect, conn, net):
+                writer.write(current_time, ids, pos)
+                if manifest["first_time"] is None:
+                    manifest["first_time"] = current_time
+                manifest["last_time"] = current_time
+                manifest["snapshots"] += 1
+        manifest["status"] = "complete"
+    except Exception as e:
+        manifest["status"] = "failed"
+        manifest["error"] = "%s: %s"%(type(e).__name__, e)
+    manifest["finished"] = time.time()
+    save_json(os.path.join(path, MANIFEST), manifest)
+    return manifest
+
+def run_scenarios(scenarios, root=SHARD_ROOT, jobs=None, memory_per_run=MEMORY_PER_RUN, trace_format="dat",
+                  collect="polling", net=None, binary="sumo", force=False):
+    # Every scenario is its own SUMO process on its own TraCI port, complete shards are kept.
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    shards = {}
+    pending = []
+    for scenario in scenarios:
+        manifest = load_json(os.path.join(root, scenario["name"], MANIFEST))
+        if not force and manifest is not None and manifest["status"] == "complete":
+            shards[scenario["name"]] = manifest
+        else:
+            pending.append(scenario)
+    try:
+        with ProcessPoolExecutor(max_jobs(jobs, memory_per_run)) as executor:
+            futures = [executor.submit(run_scenario, scenario, root, trace_format, collect, net, binary)
+                       for scenario in pending]
+            for future in as_completed(futures):
+                manifest = future.result()
+                shards[manifest["name"]] = manifest
+    finally:
+        save_json(os.path.join(root, MANIFEST), dict(
+            (name, dict(status=m["status"], trace=os.path.join(name, m["trace"]), snapshots=m["snapshots"]))
+            for name, m in shards.items()))
+    return [shards[scenario["name"]] for scenario in scenarios if scenario["name"] in shards]
+
+def parse_window(text):
+    start, end = text.split("-")
+    return float(start), float(end)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run SUMO scenarios concurrently, one trace shard each.")
+    parser.add_argument("configs", nargs="+", help="sumocfg files")
+    parser.add_argument("--seeds", nargs="+", type=int, default=SEEDS)
+    parser.add_argument("--minutes", nargs="+", type=float, default=MINUTES, help="sampling intervals")
+    parser.add_argument("--windows", nargs="+", type=parse_window, default=WINDOWS, help="start-end in hours")
+    parser.add_argument("--output", default=SHARD_ROOT)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--memory", type=float, default=MEMORY_PER_RUN, help="megabytes per SUMO run")
+    parser.add_argument("--base-port", type=int, default=BASE_PORT)
+    parser.add_argument("--trace-format", default="dat", choices=("dat", "binary"))
+    parser.add_argument("--collect", default="polling", choices=("polling", "subscription"))
+    parser.add_argument("--net", default=None, help="network used to project positions offline")
+    parser.add_argument("--sumo", default="sumo", help="SUMO binary, e.g. sumo-gui")
+    parser.add_argument("--force", action="store_true", help="rerun complete shards")
+    args = parser.parse_args(argv)
+    scenarios = plan_scenarios(args.configs, args.seeds, args.minutes, args.windows, args.base_port)
+    shards = run_scenarios(scenarios, args.output, args.jobs, args.memory, args.trace_format, args.collect, args.net,
+                           args.sumo, args.force)
+    failed = [m for m in shards if m["status"] != "complete"]
+    for m in failed:
+        print("Scenario %s failed: %s"%(m["name"], m["error"]))
+    print("%s of %s scenarios complete in %s."%(len(shards) - len(failed), len(scenarios), args.output))
+    sys.stdout.flush()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+from .trace import FILE_HEADER, INDEX_DTYPE, index_path, index_record, select_snapshots
+
+EDGE_DTYPE = np.dtype('u4,u4,f4')
+ARCHIVE_MAGIC = b"GVRGRAPH"
+ARCHIVE_VERSION = 1
+GRAPH_HEADER = np.dtype([('time', '<f8'), ('n_nodes', '<u4'), ('n_arcs', '<u4'), ('has_pos', '<u4'),
+                         ('reserved', '<u4')])
+INDEX_TYPE = np.dtype('<i4')
+WEIGHT_DTYPE = np.dtype('<f4')
+LABEL_DTYPE = np.dtype('<u4')
+POS_DTYPE = np.dtype('<f4')
+
+# Layout: one FILE_HEADER, then per snapshot a GRAPH_HEADER followed by the CSR
+# indptr (n_nodes + 1), indices and weights (n_arcs, both directions of every
+# edge), the vehicle ids (n_nodes) and, with has_pos, a (n_nodes, 2) block of
+# positions. The sidecar index at path + INDEX_SUFFIX has one INDEX_DTYPE
+# record per snapshot, as for traces, so reading a snapshot is a slice of the map.
+
+
+class SnapshotGraph(object):
+    __slots__ = ("time", "labels", "indptr", "indices", "weights")
+
+    def __init__(self, time, labels, indptr, indices, weights):
+        self.time = time
+        self.labels = labels
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @property
+    def n_nodes(self):
+        return len(self.labels)
+
+    @property
+    def n_edges(self):
+        return len(self.indices) // 2
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def adjacency(self):
+        # Unweighted, as the measures expect, sharing indptr and indices with the graph.
+        adj = sparse.csr_matrix((np.ones(len(self.indices)), self.indices, self.indptr),
+                                shape=(self.n_nodes, self.n_nodes))
+        adj.has_sorted_indices = True
+        return adj
+
+    def edges(self):
+        rows = np.repeat(np.arange(self.n_nodes, dtype=np.uint32), self.degree())
+        upper = rows < self.indices
+        edges = np.empty(np.count_nonzero(upper), dtype=EDGE_DTYPE)
+        edges['f0'] = rows[upper]
+        edges['f1'] = self.indices[upper]
+        edges['f2'] = self.weights[upper]
+        return edges
+
+def snapshot_graph(time, labels, edges):
+    n_nodes = len(labels)
+    senders = np.asarray(edges['f0'], dtype=INDEX_TYPE)
+    receivers = np.asarray(edges['f1'], dtype=INDEX_TYPE)
+    rows = np.concatenate((senders, receivers))
+    cols = np.concatenate((receivers, senders))
+    weights = np.concatenate((edges['f2'], edges['f2'])).astype(WEIGHT_DTYPE)
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_nodes + 1, dtype=INDEX_TYPE)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+    return SnapshotGraph(time, np.asarray(labels, dtype=LABEL_DTYPE), indptr, cols[order], weights[order])
+
+
+def graph_nbytes(n_nodes, n_arcs, has_pos=True):
+    return (GRAPH_HEADER.itemsize + (n_nodes + 1) * INDEX_TYPE.itemsize
+            + n_arcs * (INDEX_TYPE.itemsize + WEIGHT_DTYPE.itemsize)
+            + n_nodes * LABEL_DTYPE.itemsize + (2 * n_nodes * POS_DTYPE.itemsize if has_pos else 0))
+
+def archive_index(path):
+    # Records of snapshots an interrupted writer left incomplete are dropped.
+    idx_path = index_path(path)
+    if not os.path.isfile(idx_path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    index = np.fromfile(idx_path, dtype=INDEX_DTYPE)
+    size = os.path.getsize(path)
+    n_records = len(index)
+    while n_records and index['offset'][n_records - 1] + index['nbytes'][n_records - 1] > size:
+        n_records -= 1
+    return index[:n_records]
+
+
+class GraphArchive(object):
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.isfile(path) and os.path.getsize(path) > 0
+        if exists:
+            open_archive(path)
+            index = archive_index(path)
+            end = int(index['offset'][-1] + index['nbytes'][-1]) if len(index) else FILE_HEADER.itemsize
+            with open(path, "r+b") as f:
+                f.truncate(end)
+            with open(index_path(path), "wb") as f:
+                f.write(index.tobytes())
+        self.last_time = float(index['time'][-1]) if exists and len(index) else -np.inf
+        self.file = open(path, "ab")
+        if not exists:
+            header = np.zeros(1, dtype=FILE_HEADER)
+            header['magic'] = ARCHIVE_MAGIC
+            header['version'] = ARCHIVE_VERSION
+            self.file.write(header.tobytes())
+            open(index_path(path), "wb").close()
+        self.index = open(index_path(path), "ab")
+
+    def write(self, graph, pos=None):
+        if graph.time is None:
+            raise ValueError("Graphs are archived by time, this graph has none.")
+        header = np.zeros(1, dtype=GRAPH_HEADER)
+        header['time'] = graph.time
+        header['n_nodes'] = graph.n_nodes
+        header['n_arcs'] = len(graph.indices)
+        header['has_pos'] = pos is not None
+        offset = self.file.tell()
+        self.file.write(header.tobytes())
+        for values, dtype in ((graph.indptr, INDEX_TYPE), (graph.indices, INDEX_TYPE), (graph.weights, WEIGHT_DTYPE),
+                              (graph.labels, LABEL_DTYPE)):
+            self.file.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        if pos is not None:
+            self.file.write(np.ascontiguousarray(pos, dtype=POS_DTYPE).reshape(graph.n_nodes, 2).tobytes())
+        nbytes = graph_nbytes(graph.n_nodes, len(graph.indices), pos is not None)
+        self.index.write(index_record(graph.time, offset, nbytes, graph.n_nodes).tobytes())
+        self.last_time = graph.time
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_archive(path):
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    header = np.frombuffer(mm, FILE_HEADER, 1)[0]
+    if header['magic'] != ARCHIVE_MAGIC:
+        raise ValueError("%s is not a graph archive."%(path))
+    if header['version'] != ARCHIVE_VERSION:
+        raise ValueError("Unsupported graph archive version %s in %s."%(header['version'], path))
+    return mm
+
+def archive_graph(mm, offset):
+    # Views into the map, nothing is parsed or copied.
+    header = np.frombuffer(mm, GRAPH_HEADER, 1, offset)[0]
+    n_nodes, n_arcs = int(header['n_nodes']), int(header['n_arcs'])
+    start = offset + GRAPH_HEADER.itemsize
+    indptr = np.frombuffer(mm, INDEX_TYPE, n_nodes + 1, start)
+    start += indptr.nbytes
+    indices = np.frombuffer(mm, INDEX_TYPE, n_arcs, start)
+    start += indices.nbytes
+    weights = np.frombuffer(mm, WEIGHT_DTYPE, n_arcs, start)
+    start += weights.nbytes
+    labels = np.frombuffer(mm, LABEL_DTYPE, n_nodes, start)
+    start += labels.nbytes
+    pos = np.frombuffer(mm, POS_DTYPE, 2 * n_nodes, start).reshape(n_nodes, 2) if header['has_pos'] else None
+    return SnapshotGraph(float(header['time']), labels, indptr, indices, weights), pos
+
+def read_graphs(path, last_read_time=-1, end_time=None, snapshot_range=None):
+    mm = open_archive(path)
+    for offset in select_snapshots(archive_index(path), last_read_time, end_time, snapshot_range)['offset']:
+        yield archive_graph(mm, int(offset))
+
+def read_graph(path, time):
+    index = archive_index(path)
+    i = np.searchsorted(index['time'], time)
+    if i == len(index) or index['time'][i] != time:
+        raise KeyError("No graph at time %s in %s."%(time, path))
+    return archive_graph(open_archive(path), int(index['offset'][i]))
@@ -0,0 +1,301 @@
+import sqlite3
+
+import numpy as np
+
+from .cube import LEVELS, HIST_BINS, RHYTHM_DTYPE, bucket_range, bucket_width, combine_cells, rhythm_cells
+from .raster import COUNT_DTYPE, RASTER_BINS, RASTER_SECONDS, RhythmRaster
+
+STORE_PATH = "metrics.db"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    time REAL NOT NULL,
+    vehicle INTEGER NOT NULL,
+    measure TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (measure, time, vehicle)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    time REAL NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (time, name)
+);
+CREATE TABLE IF NOT EXISTS rhythm (
+    measure TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    n_snapshots INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    max REAL NOT NULL,
+    hist BLOB NOT NULL,
+    PRIMARY KEY (measure, level, bucket)
+);
+CREATE TABLE IF NOT EXISTS raster (
+    measure TEXT NOT NULL,
+    col INTEGER NOT NULL,
+    counts BLOB NOT NULL,
+    PRIMARY KEY (measure, col)
+);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL
+);
+"""
+PLACEHOLDERS = dict(qmark="?", format="%s", pyformat="%s")
+ROW_DTYPE = np.dtype([('time', 'f8'), ('vehicle', 'i8'), ('value', 'f8')])
+SNAPSHOT_DTYPE = np.dtype([('time', 'f8'), ('value', 'f8')])
+
+
+def snapshot_arrays(data):
+    n = len(data["labels"])
+    for name, value in data.items():
+        if name not in ("time", "labels") and np.ndim(value) == 1 and len(value) == n:
+            yield name, np.asarray(value, dtype=np.float64)
+
+def snapshot_rows(data):
+    # Per-vehicle arrays go to the long metrics table, scalars to snapshots.
+    t = float(data["time"])
+    labels = np.asarray(data["labels"], dtype=np.int64).tolist()
+    n = len(labels)
+    rows = []
+    for name, values in snapshot_arrays(data):
+        rows.extend(zip([t] * n, labels, [name] * n, values.tolist()))
+    scalars = [(t, name, float(value)) for name, value in data.items()
+               if name not in ("time", "labels") and np.ndim(value) == 0]
+    return rows, scalars
+
+def cell_rows(measure, level, cells):
+    return [(measure, level, int(c['bucket']), int(c['n_snapshots']), int(c['count']), float(c['sum']),
+             float(c['max']), c['hist'].astype('<i8').tobytes()) for c in cells]
+
+
+def rhythm_array(rows, level):
+    cells = np.zeros(len(rows), dtype=RHYTHM_DTYPE)
+    for i, (bucket, n_snapshots, count, total, maximum, hist) in enumerate(rows):
+        cells[i] = (bucket, bucket * level * 60., n_snapshots, count, total, maximum,
+                    np.frombuffer(hist, dtype='<i8', count=HIST_BINS))
+    return cells
+
+
+def raster_from_rows(measure, rows):
+    raster = RhythmRaster(measure)
+    if rows:
+        columns = [col for col, _ in rows]
+        raster.grow(min(columns), max(columns))
+        for col, counts in rows:
+            raster.counts[col - raster.first] = np.frombuffer(counts, dtype=COUNT_DTYPE, count=RASTER_BINS)
+    return raster
+
+
+class DBAPISink(object):
+    # Any DB-API 2.0 connection whose database already has the tables of SCHEMA.
+    # Unless the connection may be shared between threads (thread_safe), the
+    # BufferedWriter writes it from the thread that appends the results.
+    def __init__(self, conn, paramstyle="qmark", thread_safe=False):
+        if paramstyle not in PLACEHOLDERS:
+            raise ValueError("Unsupported paramstyle %s, use one of %s."%(paramstyle, sorted(PLACEHOLDERS)))
+        self.conn = conn
+        self.thread_safe = thread_safe
+        self.mark = PLACEHOLDERS[paramstyle]
+        self.rows = []
+        self.scalars = []
+        self.samples = {}
+        self.times = []
+
+    def statement(self, sql):
+        return sql.replace("%s", self.mark)
+
+    def append(self, data):
+        rows, scalars = snapshot_rows(data)
+        self.rows.extend(rows)
+        self.scalars.extend(scalars)
+        t = float(data["time"])
+        self.times.append(t)
+        for name, values in snapshot_arrays(data):
+            self.samples.setdefault(name, []).append((np.full(len(values), t), values))
+
+    def write(self, batch):
+        # The whole batch and the new checkpoint are committed in one transaction.
+        for data in batch:
+            self.append(data)
+        self.flush(float(batch[-1]["time"]) if batch else None)
+
+    def flush(self, checkpoint=None):
+        if not self.rows and not self.scalars and checkpoint is None:
+            return
+        cursor = self.conn.cursor()
+        try:
+            # Snapshots written before, by an earlier run over the same trace, are replaced.
+            replaced = False
+            if self.times:
+                cursor.execute(self.statement("SELECT count(*) FROM snapshots WHERE time BETWEEN %s AND %s"),
+                               (min(self.times), max(self.times)))
+                replaced = cursor.fetchone()[0] > 0
+            cursor.executemany(self.statement("DELETE FROM metrics WHERE measure = %s AND time = %s"),
+                               [(measure, t) for measure in self.samples for t in self.times])
+            cursor.executemany(self.statement("DELETE FROM snapshots WHERE time = %s"), [(t,) for t in self.times])
+            cursor.executemany(self.statement("INSERT INTO metrics VALUES (%s, %s, %s, %s)"), self.rows)
+            cursor.executemany(self.statement("INSERT INTO snapshots VALUES (%s, %s, %s)"), self.scalars)
+            for measure, samples in self.samples.items():
+                if replaced:
+                    # Adding to the stored cells would count the replaced snapshots twice.
+                    self.rebuild_cells(cursor, measure, min(self.times), max(self.times))
+                    continue
+                times = np.concatenate([t for t, _ in samples])
+                values = np.concatenate([v for _, v in samples])
+                for level in LEVELS:
+                    self.merge_rhythm(cursor, measure, level, rhythm_cells(measure, times, values, level))
+                raster = RhythmRaster(measure)
+                raster.add(times, values)
+                self.merge_raster(cursor, raster)
+            if checkpoint is not None:
+                cursor.execute("DELETE FROM checkpoint")
+                cursor.execute(self.statement("INSERT INTO checkpoint VALUES (0, %s)"), (checkpoint,))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.rows = []
+        self.scalars = []
+        self.samples = {}
+        self.times = []
+
+    def merge_rhythm(self, cursor, measure, level, cells):
+        # Buckets already holding snapshots of earlier batches are read back and combined.
+        if len(cells) == 0:
+            return
+        first, last = int(cells['bucket'][0]), int(cells['bucket'][-1])
+        key = (measure, level, first, last)
+        where = " WHERE measure = %s AND level = %s AND bucket BETWEEN %s AND %s"
+        cursor.execute(self.statement("SELECT bucket, n_snapshots, count, sum, max, hist FROM rhythm" + where), key)
+        stored = rhythm_array(cursor.fetchall(), level)
+        if len(stored):
+            cells = combine_cells(stored, cells)
+            cursor.execute(self.statement("DELETE FROM rhythm" + where), key)
+        cursor.executemany(self.statement("INSERT INTO rhythm VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"),
+                           cell_rows(measure, level, cells))
+
+    def merge_raster(self, cursor, raster):
+        if len(raster.counts) == 0:
+            return
+        key = (raster.measure, int(raster.first), int(raster.first + len(raster.counts) - 1))
+        where = " WHERE measure = %s AND col BETWEEN %s AND %s"
+        cursor.execute(self.statement("SELECT col, counts FROM raster" + where), key)
+        stored = raster_from_rows(raster.measure, cursor.fetchall())
+        if len(stored.counts):
+            raster.merge(stored)
+            cursor.execute(self.statement("DELETE FROM raster" + where), key)
+        # Columns without vehicles are not stored.
+        cursor.executemany(self.statement("INSERT INTO raster VALUES (%s, %s, %s)"),
+                           [(raster.measure, int(col), counts.tobytes())
+                            for col, counts in zip(raster.columns(), raster.counts) if counts.any()])
+
+    def rebuild_cells(self, cursor, measure, start, end):
+        # The rhythm buckets and raster columns holding times in [start, end] are
+        # aggregated again from the metrics rows.
+        spans = [(level, bucket_width(level)) for level in LEVELS] + [(None, RASTER_SECONDS)]
+        lower = min(np.floor(start / width) * width for _, width in spans)
+        upper = max((np.floor(end / width) + 1) * width for _, width in spans)
+        cursor.execute(self.statement("SELECT time, value FROM metrics WHERE measure = %s AND time >= %s AND time < %s"),
+                       (measure, float(lower), float(upper)))
+        rows = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 2)
+        for level, width in spans:
+            first, last = int(np.floor(start / width)), int(np.floor(end / width))
+            inside = (rows[:, 0] >= first * width) & (rows[:, 0] < (last + 1) * width)
+            times, values = rows[inside, 0], rows[inside, 1]
+            if level is None:
+                cursor.execute(self.statement("DELETE FROM raster WHERE measure = %s AND col BETWEEN %s AND %s"),
+                               (measure, first, last))
+                raster = RhythmRaster(measure)
+                raster.add(times, values)
+                self.merge_raster(cursor, raster)
+            else:
+                cursor.execute(self.statement("DELETE FROM rhythm WHERE measure = %s AND level = %s "
+                                              "AND bucket BETWEEN %s AND %s"), (measure, level, first, last))
+                self.merge_rhythm(cursor, measure, level, rhythm_cells(measure, times, values, level))
+
+    def checkpoint(self):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT time FROM checkpoint")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return -1 if row is None else row[0]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MetricsStore(DBAPISink):
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        super(MetricsStore, self).__init__(conn, thread_safe=True)
+
+    def load(self, measure, start=None, end=None):
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        cursor = self.conn.execute(
+            "SELECT time, vehicle, value FROM metrics WHERE measure = ? AND time BETWEEN ? AND ? ORDER BY time",
+            (measure, start, end))
+        return np.fromiter(cursor, dtype=ROW_DTYPE)
+
+    def load_snapshots(self, name, start=None, end=None):
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        cursor = self.conn.execute(
+            "SELECT time, value FROM snapshots WHERE name = ? AND time BETWEEN ? AND ? ORDER BY time",
+            (name, start, end))
+        return np.fromiter(cursor, dtype=SNAPSHOT_DTYPE)
+
+    def load_rhythm(self, measure, level, start=None, end=None):
+        first, last = bucket_range(start, end, bucket_width(level))
+        cursor = self.conn.execute(
+            "SELECT bucket, n_snapshots, count, sum, max, hist FROM rhythm"
+            " WHERE measure = ? AND level = ? AND bucket BETWEEN ? AND ? ORDER BY bucket",
+            (measure, level, first, last))
+        return rhythm_array(cursor.fetchall(), level)
+
+    def load_raster(self, measure, start=None, end=None):
+        first, last = bucket_range(start, end, RASTER_SECONDS)
+        cursor = self.conn.execute(
+            "SELECT col, counts FROM raster WHERE measure = ? AND col BETWEEN ? AND ? ORDER BY col",
+            (measure, first, last))
+        return raster_from_rows(measure, cursor.fetchall())
+
+    def rebuild_rhythm(self, start=None, end=None):
+        # Aggregates a store written before the rhythm and raster tables existed,
+        # or only the buckets holding times in [start, end].
+        with self.conn:
+            if start is None:
+                self.conn.execute("DELETE FROM rhythm")
+                self.conn.execute("DELETE FROM raster")
+                start, end = self.conn.execute("SELECT min(time), max(time) FROM metrics").fetchone()
+                if start is None:
+                    return
+            cursor = self.conn.cursor()
+            for measure in self.measures():
+                self.rebuild_cells(cursor, measure, start, end)
+
+    def version(self):
+        # Changes with every committed batch, unlike file times which readers touch too.
+        return list(self.conn.execute(
+            "SELECT (SELECT max(rowid) FROM metrics), (SELECT count(*) FROM rhythm), (SELECT total(count) FROM rhythm)"
+        ).fetchone())
+
+    def measures(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT measure FROM metrics")]
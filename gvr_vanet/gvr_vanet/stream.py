@@ -0,0 +1,89 @@
+import sys
+import queue
+import threading
+import logging
+import logging.handlers as handlers
+
+from .graph import RangeSweep, last_checkpoint, measure_snapshots, process_trace_snapshot
+from .metrics import DEFAULT_MEASURES
+from .store import STORE_PATH
+from .sampler import sample_simulation
+from .trace import open_writer
+from .writer import BATCH_SIZE, FLUSH_INTERVAL
+
+END_OF_STREAM = None
+
+
+def produce(samples, snapshots, stop, writer=None):
+    try:
+        for sample in samples:
+            if stop.is_set():
+                break
+            if writer:
+                writer.write(*sample)
+            # Blocks while the queue is full, so the simulation waits for the workers.
+            snapshots.put(sample)
+    finally:
+        samples.close()
+        if writer:
+            writer.close()
+        snapshots.put(END_OF_STREAM)
+
+def consume(snapshots):
+    while True:
+        sample = snapshots.get()
+        if sample is END_OF_STREAM:
+            return
+        yield sample
+
+def measure_simulation(sumocfg, minutes=10, tripinfo="trip_info.xml", last_read_time=-1, tee=None, trace_format="dat",
+                       max_queue=16, n_proc=None, db=None, collection=None,
+                       n_workers=None, max_in_flight=None, ordered=True, collect="polling", conn=None,
+                       net=None, measures=DEFAULT_MEASURES, approx=None,
+                       store=STORE_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, resume=False,
+                       instrument=None, ranges=None, classes=None, graph_archive=None):
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_logger = logging.getLogger('Logger')
+    file_logger.setLevel(logging.DEBUG)
+    file_handler = handlers.RotatingFileHandler(
+        'run_sumo.log', maxBytes=200 * 1024 * 1024, backupCount=1
+    )
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(formatter)
+    file_logger.addHandler(file_handler)
+
+    if resume:
+        if n_workers and not ordered:
+            raise ValueError("Resuming needs ordered commits, the checkpoint of an unordered run may skip snapshots.")
+        last_read_time = max(last_read_time, last_checkpoint(store, db, collection))
+
+    errors = []
+    stop = threading.Event()
+    snapshots = queue.Queue(maxsize=max_queue)
+    writer = open_writer(tee, trace_format) if tee else None
+    samples = sample_simulation(sumocfg, minutes, tripinfo, last_read_time, file_logger, collect, conn, net)
+
+    def run():
+        try:
+            produce(samples, snapshots, stop, writer)
+        except Exception as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=run, name="sumo-producer", daemon=True)
+    producer.start()
+    try:
+        measure_snapshots(consume(snapshots), process_trace_snapshot, n_proc, db, collection,
+                          n_workers, max_in_flight, ordered, measures, approx, store,
+                          batch_size, flush_interval, instrument,
+                          None if ranges is None else RangeSweep(ranges, classes), graph_archive)
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue so it can close TraCI.
+        while producer.is_alive():
+            try:
+                snapshots.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    if errors:
+        raise errors[0]
+    sys.stdout.flush()
@@ -0,0 +1,259 @@
+import os
+
+import numpy as np
+
+TRACE_MAGIC = b"GVRTRACE"
+TRACE_VERSION = 1
+FILE_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('reserved', '<u4')])
+SNAPSHOT_HEADER = np.dtype([('time', '<f8'), ('count', '<u4'), ('reserved', '<u4')])
+ID_DTYPE = np.dtype('<u4')
+POS_DTYPE = np.dtype('<f4')
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8'), ('nbytes', '<u8'), ('count', '<u4'), ('reserved', '<u4')])
+INDEX_SUFFIX = ".idx"
+
+# Layout: one FILE_HEADER, then per snapshot a SNAPSHOT_HEADER followed by
+# `count` ids and a (count, 2) block of x/y positions. Both formats get a
+# sidecar index of INDEX_DTYPE records, one per snapshot, at path + INDEX_SUFFIX.
+
+
+def snapshot_nbytes(count):
+    return SNAPSHOT_HEADER.itemsize + count * (ID_DTYPE.itemsize + 2 * POS_DTYPE.itemsize)
+
+def is_trace(path):
+    if not os.path.isfile(path) or os.path.getsize(path) < FILE_HEADER.itemsize:
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+def index_record(time, offset, nbytes, count):
+    record = np.zeros(1, dtype=INDEX_DTYPE)
+    record['time'] = time
+    record['offset'] = offset
+    record['nbytes'] = nbytes
+    record['count'] = count
+    return record
+
+
+class DatWriter(object):
+    def __init__(self, path, index=True):
+        self.path = path
+        self.index = None
+        if index:
+            update_index(path)
+            self.index = open(index_path(path), "ab")
+        self.file = open(path, "ab")
+
+    def write(self, time, ids, pos):
+        lines = [str(index) + ":" + str(x) + ":" + str(y) + "\n"
+                 for index, (x, y) in zip(np.asarray(ids).tolist(), np.asarray(pos).tolist())]
+        lines.append("END " + str(time) + " \n")
+        data = "".join(lines).encode()
+        offset = self.file.tell()
+        self.file.write(data)
+        if self.index:
+            self.index.write(index_record(time, offset, len(data), len(lines) - 1).tobytes())
+
+    def flush(self):
+        self.file.flush()
+        if self.index:
+            self.index.flush()
+
+    def close(self):
+        self.file.close()
+        if self.index:
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TraceWriter(object):
+    def __init__(self, path, index=True):
+        self.path = path
+        exists = os.path.isfile(path) and os.path.getsize(path) > 0
+        if exists and not is_trace(path):
+            raise ValueError("%s exists and is not a binary trace."%(path))
+        self.index = None
+        if index and exists:
+            update_index(path)
+        self.file = open(path, "ab")
+        if not exists:
+            header = np.zeros(1, dtype=FILE_HEADER)
+            header['magic'] = TRACE_MAGIC
+            header['version'] = TRACE_VERSION
+            self.file.write(header.tobytes())
+            if index:
+                open(index_path(path), "wb").close()
+        if index:
+            self.index = open(index_path(path), "ab")
+
+    def write(self, time, ids, pos):
+        ids = np.ascontiguousarray(ids, dtype=ID_DTYPE)
+        pos = np.ascontiguousarray(pos, dtype=POS_DTYPE).reshape(len(ids), 2)
+        header = np.zeros(1, dtype=SNAPSHOT_HEADER)
+        header['time'] = time
+        header['count'] = len(ids)
+        offset = self.file.tell()
+        self.file.write(header.tobytes())
+        self.file.write(ids.tobytes())
+        self.file.write(pos.tobytes())
+        if self.index:
+            self.index.write(index_record(time, offset, snapshot_nbytes(len(ids)), len(ids)).tobytes())
+
+    def flush(self):
+        self.file.flush()
+        if self.index:
+            self.index.flush()
+
+    def close(self):
+        self.file.close()
+        if self.index:
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_writer(path, trace_format="dat"):
+    if trace_format == "dat":
+        return DatWriter(path)
+    elif trace_format == "binary":
+        return TraceWriter(path)
+    raise ValueError("Unknown trace format %s, use 'dat' or 'binary'."%(trace_format))
+
+def trace_snapshot(mm, offset):
+    snapshot = np.frombuffer(mm, SNAPSHOT_HEADER, 1, offset)[0]
+    count = int(snapshot['count'])
+    start = offset + SNAPSHOT_HEADER.itemsize
+    ids = np.frombuffer(mm, ID_DTYPE, count, start)
+    pos = np.frombuffer(mm, POS_DTYPE, 2 * count, start + count * ID_DTYPE.itemsize).reshape(count, 2)
+    return float(snapshot['time']), ids, pos
+
+def open_trace(path):
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    header = np.frombuffer(mm, FILE_HEADER, 1)[0]
+    if header['magic'] != TRACE_MAGIC:
+        raise ValueError("%s is not a binary trace."%(path))
+    if header['version'] != TRACE_VERSION:
+        raise ValueError("Unsupported trace version %s in %s."%(header['version'], path))
+    return mm
+
+def scan_trace(path, offset=0):
+    size = os.path.getsize(path)
+    if size <= FILE_HEADER.itemsize:
+        return
+    mm = open_trace(path)
+    offset = max(offset, FILE_HEADER.itemsize)
+    while offset + SNAPSHOT_HEADER.itemsize <= size:
+        snapshot = np.frombuffer(mm, SNAPSHOT_HEADER, 1, offset)[0]
+        count = int(snapshot['count'])
+        nbytes = snapshot_nbytes(count)
+        # A snapshot still being written by the runner is left for a later read.
+        if offset + nbytes > size:
+            break
+        yield index_record(snapshot['time'], offset, nbytes, count)
+        offset += nbytes
+
+def scan_dat(path, offset=0):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        start = offset
+        count = 0
+        for line in f:
+            # The last line may still be half written.
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            if b"END" not in line:
+                count += 1
+            else:
+                yield index_record(float(line.split(b" ")[1]), start, offset - start, count)
+                start = offset
+                count = 0
+
+def current_index(path):
+    # The sidecar records that point inside the data, followed by records of the
+    # snapshots written after them, built in memory.
+    if not os.path.isfile(path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    index = np.array(load_index(path, update=False))
+    # Drop records left truncated, or pointing past the data, by an interrupted writer.
+    n_records = len(index)
+    size = os.path.getsize(path)
+    while n_records and index['offset'][n_records - 1] + index['nbytes'][n_records - 1] > size:
+        n_records -= 1
+    index = index[:n_records]
+    offset = int(index['offset'][-1] + index['nbytes'][-1]) if n_records else 0
+    scan = scan_trace if is_trace(path) else scan_dat
+    return np.concatenate([index] + list(scan(path, offset)))
+
+def update_index(path):
+    # Rewrites the sidecar, only writers call it: they own the sidecar while open.
+    index = current_index(path)
+    with open(index_path(path), "wb") as f:
+        f.write(index.tobytes())
+    return index
+
+def load_index(path, update=True):
+    # Readers never write the sidecar, a stale one is completed in memory.
+    if update:
+        return current_index(path)
+    idx_path = index_path(path)
+    if not os.path.isfile(idx_path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    n_records = os.path.getsize(idx_path) // INDEX_DTYPE.itemsize
+    if n_records == 0:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(idx_path, dtype=INDEX_DTYPE, mode="r", shape=(n_records,))
+
+def select_snapshots(index, last_read_time=-1, end_time=None, snapshot_range=None):
+    first, last = 0, len(index)
+    if snapshot_range is not None:
+        first, last = max(first, snapshot_range[0]), min(last, snapshot_range[1])
+    times = index['time']
+    first = max(first, np.searchsorted(times, last_read_time, side="right"))
+    if end_time is not None:
+        last = min(last, np.searchsorted(times, end_time, side="right"))
+    return index[first:last] if first < last else index[:0]
+
+def read_trace(path, last_read_time=-1):
+    if os.path.getsize(path) <= FILE_HEADER.itemsize:
+        return
+    mm = open_trace(path)
+    for record in scan_trace(path):
+        if record['count'][0] > 0 and record['time'][0] > last_read_time:
+            yield trace_snapshot(mm, int(record['offset'][0]))
+
+def read_snapshots(path, last_read_time=-1, end_time=None, snapshot_range=None):
+    records = select_snapshots(load_index(path), last_read_time, end_time, snapshot_range)
+    records = records[records['count'] > 0]
+    if is_trace(path):
+        mm = open_trace(path)
+        for offset in records['offset']:
+            yield trace_snapshot(mm, int(offset))
+    else:
+        with open(path, "rb") as f:
+            for offset, nbytes in zip(records['offset'], records['nbytes']):
+                f.seek(int(offset))
+                yield f.read(int(nbytes)).decode()
+
+def convert_dat(dat_path, trace_path):
+    from .graph import parse_lines, read_file_graph
+
+    n_snapshots = 0
+    with TraceWriter(trace_path) as writer:
+        for graph_lines in read_file_graph(dat_path):
+            time, labels, pos = parse_lines(graph_lines)
+            writer.write(time, labels, pos)
+            n_snapshots += 1
+    return n_snapshots
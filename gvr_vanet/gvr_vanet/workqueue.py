@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import sqlite3
+import argparse
+import threading
+import contextlib
+
+from .graph import measure_graphs
+from .store import STORE_PATH, MetricsStore
+from .trace import load_index
+
+QUEUE_PATH = "queue.db"
+SHARD_ROOT = "results/"
+# Snapshots per task, an hour of the Cologne trace sampled every 30 seconds.
+CHUNK = 120
+LEASE = 600.
+POLL = 10.
+MAX_ATTEMPTS = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    trace TEXT NOT NULL,
+    first INTEGER NOT NULL,
+    last INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    merged INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (trace, first, last)
+);
+"""
+TASK_COLUMNS = ("id", "trace", "first", "last", "output", "options", "attempts")
+
+
+def worker_name():
+    return "%s-%s"%(socket.gethostname(), os.getpid())
+
+def shard_path(root, trace, first, last):
+    # Traces in different directories often share a name, the hash of the full path tells them apart.
+    trace = os.path.abspath(trace)
+    name = os.path.splitext(os.path.basename(trace))[0]
+    digest = hashlib.sha1(trace.encode("utf-8")).hexdigest()[:12]
+    return os.path.abspath(os.path.join(root, "%s-%s_%s-%s.db"%(name, digest, first, last)))
+
+
+class WorkQueue(object):
+    # Tasks are snapshot ranges of a trace index, leased to one worker at a time.
+    def __init__(self, path=QUEUE_PATH, timeout=60.):
+        self.path = path
+        # A rollback journal, WAL needs shared memory that network filesystems do not provide.
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same task.
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def update(self, sql, params=()):
+        with self.transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def publish(self, trace, root=SHARD_ROOT, chunk=CHUNK, **options):
+        # Publishing the same trace again adds nothing, the ranges are unique.
+        n_snapshots = len(load_index(trace))
+        trace = os.path.abspath(trace)
+        ranges = [(first, min(first + chunk, n_snapshots)) for first in range(0, n_snapshots, chunk)]
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO tasks (trace, first, last, output, options) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             [(trace, first, last, shard_path(root, trace, first, last),
+                               json.dumps(options, sort_keys=True)) for first, last in ranges])
+            return conn.total_changes - before
+
+    def claim(self, owner, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        # Leases that expired, after a worker crashed, are handed out again unless
+        # the task already crashed its workers max_attempts times.
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET status = 'failed', owner = NULL, expires = NULL, "
+                         "error = 'lease expired on attempt ' || attempts "
+                         "WHERE status = 'leased' AND expires < ? AND attempts >= ?", (now, max_attempts))
+            row = conn.execute(
+                "SELECT %s FROM tasks WHERE status = 'pending' OR (status = 'leased' AND expires < ?) "
+                "ORDER BY id LIMIT 1"%(", ".join(TASK_COLUMNS)), (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET status = 'leased', owner = ?, expires = ?, attempts = attempts + 1 "
+                         "WHERE id = ?", (owner, now + lease, row[0]))
+        task = dict(zip(TASK_COLUMNS, row))
+        task["options"] = json.loads(task["options"])
+        task["attempts"] += 1
+        return task
+
+    def renew(self, task_id, owner, lease=LEASE):
+        return self.update("UPDATE tasks SET expires = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                           (time.time() + lease, task_id, owner)) == 1
+
+    def complete(self, task_id, owner):
+        # False when the lease was lost, the other worker writes the same shard.
+        return self.update("UPDATE tasks SET status = 'done', expires = NULL, error = NULL "
+                           "WHERE id = ? AND owner = ? AND status = 'leased'", (task_id, owner)) == 1
+
+    def fail(self, task_id, owner, error, max_attempts=MAX_ATTEMPTS):
+        self.update("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "owner = NULL, expires = NULL, error = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                    (max_attempts, error, task_id, owner))
+
+    def unmerged(self):
+        return self.conn.execute(
+            "SELECT id, output FROM tasks WHERE status = 'done' AND merged = 0 ORDER BY trace, first").fetchall()
+
+    def mark_merged(self, task_id):
+        self.update("UPDATE tasks SET merged = 1 WHERE id = ?", (task_id,))
+
+    def status(self):
+        return dict(self.conn.execute("SELECT status, count(*) FROM tasks GROUP BY status").fetchall())
+
+    def remaining(self):
+        status = self.status()
+        return status.get("pending", 0) + status.get("leased", 0)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def heartbeat(path, task_id, owner, lease, stop):
+    # Its own connection, sqlite3 connections stay in the thread that opened them.
+    with WorkQueue(path) as queue:
+        while not stop.wait(lease / 3.):
+            if not queue.renew(task_id, owner, lease):
+                return
+
+def process_task(task, owner, n_proc=None):
+    # The shard is written under a private name and renamed, so a crash never leaves a partial
+    # shard and running a task twice gives the same file.
+    options = dict(task["options"])
+    if options.get("classes"):
+        options["classes"] = dict((int(k), v) for k, v in options["classes"].items())
+    output = task["output"]
+    if not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    staging = "%s.%s.tmp"%(output, owner)
+    for name in (staging, staging + "-wal", staging + "-shm"):
+        if os.path.isfile(name):
+            os.remove(name)
+    measure_graphs(task["trace"], n_proc=n_proc, snapshot_range=(task["first"], task["last"]), store=staging,
+                   **options)
+    os.replace(staging, output)
+    return output
+
+def run_worker(path=QUEUE_PATH, owner=None, lease=LEASE, n_proc=None, poll=POLL, max_attempts=MAX_ATTEMPTS):
+    owner = worker_name() if owner is None else owner
+    done = 0
+    with WorkQueue(path) as queue:
+        while True:
+            task = queue.claim(owner, lease, max_attempts)
+            if task is None:
+                # Leases held by other workers may still expire and come back.
+                if queue.remaining() == 0:
+                    return done
+                time.sleep(poll)
+                continue
+            stop = threading.Event()
+            beat = threading.Thread(target=heartbeat, args=(path, task["id"], owner, lease, stop))
+            beat.daemon = True
+            beat.start()
+            try:
+                process_task(task, owner, n_proc)
+            except Exception as e:
+                queue.fail(task["id"], owner, "%s: %s"%(type(e).__name__, e), max_attempts)
+                continue
+            finally:
+                stop.set()
+                beat.join()
+            if queue.complete(task["id"], owner):
+                done += 1
+
+def merge_shard(store, path):
+    # The shard's time span is replaced, so merging a shard twice leaves the store unchanged.
+    # Returns that span, None for a shard without snapshots.
+    conn = store.conn
+    conn.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        with conn:
+            first, last = conn.execute("SELECT min(time), max(time) FROM shard.snapshots").fetchone()
+            if first is not None:
+                conn.execute("DELETE FROM metrics WHERE time BETWEEN ? AND ?", (first, last))
+                conn.execute("DELETE FROM snapshots WHERE time BETWEEN ? AND ?", (first, last))
+            conn.execute("INSERT INTO metrics SELECT * FROM shard.metrics")
+            conn.execute("INSERT OR REPLACE INTO snapshots SELECT * FROM shard.snapshots")
+    finally:
+        conn.execute("DETACH DATABASE shard")
+    return None if first is None else (first, last)
+
+def merge_results(path=QUEUE_PATH, store_path=STORE_PATH):
+    merged = 0
+    with WorkQueue(path) as queue, MetricsStore(store_path) as store:
+        for task_id, output in queue.unmerged():
+            span = merge_shard(store, output)
+            if span is not None:
+                # Time buckets may span shards, so the buckets of the shard are aggregated again from all rows.
+                store.rebuild_rhythm(*span)
+            queue.mark_merged(task_id)
+            merged += 1
+    return merged
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Share the snapshots of a trace among workers through a queue.")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="queue database on a shared filesystem")
+    commands = parser.add_subparsers(dest="command")
+    publish = commands.add_parser("publish", help="add the snapshot ranges of a trace")
+    publish.add_argument("trace")
+    publish.add_argument("--output", default=SHARD_ROOT, help="shared directory for the shard stores")
+    publish.add_argument("--chunk", type=int, default=CHUNK, help="snapshots per task")
+    publish.add_argument("--measures", nargs="+", default=None)
+    publish.add_argument("--ranges", nargs="+", type=float, default=None)
+    work = commands.add_parser("work", help="process tasks until the queue is empty")
+    work.add_argument("--lease", type=float, default=LEASE, help="seconds")
+    work.add_argument("--n-proc", type=int, default=None)
+    work.add_argument("--poll", type=float, default=POLL)
+    merge = commands.add_parser("merge", help="merge finished shards into one store")
+    merge.add_argument("--store", default=STORE_PATH)
+    commands.add_parser("status")
+    args = parser.parse_args(argv)
+
+    if args.command == "publish":
+        options = {}
+        if args.measures:
+            options["measures"] = args.measures
+        if args.ranges:
+            options["ranges"] = args.ranges
+        with WorkQueue(args.queue) as queue:
+            print("%s tasks published."%(queue.publish(args.trace, args.output, args.chunk, **options)))
+    elif args.command == "work":
+        print("%s tasks processed."%(run_worker(args.queue, lease=args.lease, n_proc=args.n_proc, poll=args.poll)))
+    elif args.command == "merge":
+        print("%s shards merged into %s."%(merge_results(args.queue, args.store), args.store))
+    else:
+        with WorkQueue(args.queue) as queue:
+            print(" ".join("%s=%s"%item for item in sorted(queue.status().items())))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import queue
+import threading
+
+import numpy as np
+
+from .store import MetricsStore
+
+BATCH_SIZE = 32
+FLUSH_INTERVAL = 5.0
+CHECKPOINT_FILE = "checkpoint"
+CLOSE = object()
+
+
+def json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("%s is not JSON serializable"%(type(obj)))
+
+
+class JSONSink(object):
+    def __init__(self, root="graph_doc/", use_dir=False):
+        self.root = root
+        self.use_dir = use_dir
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def write(self, batch):
+        for data in batch:
+            if self.use_dir:
+                path = os.path.join(self.root, str(data["time"]))
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                path = os.path.join(path, "metrics.json")
+            else:
+                path = os.path.join(self.root, str(data["time"]) + ".json")
+            with open(path, "w") as f:
+                json.dump(data, f, default=json_default)
+        if batch:
+            # Replace the checkpoint atomically once every file of the batch is written.
+            path = os.path.join(self.root, CHECKPOINT_FILE)
+            with open(path + ".tmp", "w") as f:
+                f.write(repr(float(batch[-1]["time"])))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+
+    def checkpoint(self):
+        path = os.path.join(self.root, CHECKPOINT_FILE)
+        if not os.path.isfile(path):
+            return -1
+        with open(path) as f:
+            return float(f.read())
+
+    def close(self):
+        pass
+
+
+class MongoSink(object):
+    # Any object with pymongo's insert_many/replace_one/find_one collection methods works.
+    def __init__(self, db, collection):
+        self.collection = db[collection]
+        self.checkpoints = db[collection + "_checkpoint"]
+
+    def write(self, batch):
+        if not batch:
+            return
+        documents = [json.loads(json.dumps(data, default=json_default)) for data in batch]
+        self.collection.insert_many(documents)
+        self.checkpoints.replace_one({"_id": 0}, {"_id": 0, "time": float(batch[-1]["time"])}, upsert=True)
+
+    def checkpoint(self):
+        document = self.checkpoints.find_one({"_id": 0})
+        return -1 if document is None else document["time"]
+
+    def close(self):
+        pass
+
+
+def open_sink(store, db=None, collection=None, root="graph_doc/"):
+    if db is not None and collection is not None:
+        return MongoSink(db, collection)
+    if store is None:
+        return JSONSink(root)
+    if isinstance(store, str):
+        return MetricsStore(store)
+    return store
+
+
+class BufferedWriter(object):
+    # Sinks with thread_safe set to False are written from the thread calling
+    # append and close instead of a writer thread.
+    def __init__(self, sink, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_pending=0, instrument=None):
+        self.sink = sink
+        self.instrument = instrument
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+        self.last_time = None
+        self.batch = []
+        self.deadline = None
+        self.thread = None
+        if getattr(sink, "thread_safe", True):
+            self.thread = threading.Thread(target=self.run, name="metrics-writer")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def append(self, data):
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            self.collect(data)
+        else:
+            self.pending.put(data)
+
+    def collect(self, data, done=False):
+        if data is not None:
+            self.batch.append(data)
+            if self.deadline is None:
+                self.deadline = time.time() + self.flush_interval
+        if self.batch and (done or len(self.batch) >= self.batch_size or time.time() >= self.deadline):
+            self.commit(self.batch)
+            self.batch = []
+            self.deadline = None
+
+    def run(self):
+        done = False
+        while not done:
+            timeout = None if self.deadline is None else max(self.deadline - time.time(), 0)
+            try:
+                data = self.pending.get(timeout=timeout)
+            except queue.Empty:
+                data = None
+            done = data is CLOSE
+            self.collect(None if done else data, done)
+
+    def commit(self, batch):
+        # After a failure the rest is drained and dropped, so producers never block on a dead sink.
+        if self.error is not None:
+            return
+        try:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            self.sink.write(batch)
+            if self.instrument is not None:
+                self.instrument.record("store", time.perf_counter() - wall, time.thread_time() - cpu)
+            self.last_time = batch[-1]["time"]
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        if self.thread is None:
+            self.collect(None, True)
+        else:
+            self.pending.put(CLOSE)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
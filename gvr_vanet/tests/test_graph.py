@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from gvr_vanet.graph import TRANSMISSION_RANGE, kdtree_edges, neighbor_edges, parse_lines, reference_edges
+
+
+def edge_set(edges):
+    return dict(((int(u), int(v)), float(w)) for u, v, w in edges.tolist())
+
+def test_engines_agree_on_random_positions():
+    rng = np.random.default_rng(0)
+    pos = (rng.random((400, 2)) * 2000).astype(np.float32)
+    kdtree, reference = edge_set(kdtree_edges(pos, TRANSMISSION_RANGE)), edge_set(reference_edges(pos, TRANSMISSION_RANGE, 1))
+    assert kdtree.keys() == reference.keys()
+    assert np.allclose([kdtree[k] for k in reference], list(reference.values()), atol=1e-3)
+
+def test_engines_agree_on_duplicates_and_the_range_boundary():
+    pos = np.array([[0, 0], [0, 0], [200, 0], [0, 200], [200.5, 0], [500, 500], [500, 500]], dtype=np.float32)
+    kdtree, reference = edge_set(kdtree_edges(pos, 200.)), edge_set(reference_edges(pos, 200., 1))
+    assert kdtree.keys() == reference.keys()
+    # Duplicates are neighbors at distance zero, pairs exactly at the range are kept.
+    assert kdtree[(0, 1)] == 0. and kdtree[(5, 6)] == 0.
+    assert kdtree[(0, 2)] == 200. and kdtree[(1, 3)] == 200.
+    assert (0, 4) not in kdtree and (2, 3) not in kdtree
+    for key, weight in reference.items():
+        assert np.isclose(kdtree[key], weight)
+
+def test_edges_are_sorted_upper_pairs():
+    rng = np.random.default_rng(1)
+    edges = neighbor_edges((rng.random((300, 2)) * 1000).astype(np.float32))
+    assert (edges['f0'] < edges['f1']).all()
+    assert (np.lexsort((edges['f1'], edges['f0'])) == np.arange(len(edges))).all()
+
+def test_fewer_than_two_vehicles_have_no_edges():
+    assert len(neighbor_edges(np.zeros((1, 2), dtype=np.float32))) == 0
+
+@pytest.mark.parametrize("block, line", [
+    ("3:1:2:\n4:5:6\nEND 30 \n", 1),
+    ("3:1\n4:5:6:7\nEND 30 \n", 1),
+    ("1:2:3\n4:5:x\nEND 30 \n", 2),
+    ("1:2:3\n\n4:5:6\nEND 30 \n", 2),
+])
+def test_malformed_lines_are_rejected(block, line):
+    with pytest.raises(ValueError, match="line %s "%line):
+        parse_lines(block)
+
+def test_parse_lines():
+    time, labels, pos = parse_lines("7:1.5:2\n3:4:5.25\nEND 30 \n")
+    assert time == 30.
+    assert labels.tolist() == [7, 3]
+    assert pos.tolist() == [[1.5, 2.], [4., 5.25]]
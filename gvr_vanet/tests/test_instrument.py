@@ -0,0 +1,29 @@
+import time
+import threading
+
+from gvr_vanet.instrument import Instrumentation, timed
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def test_elapsed_counts_from_the_start_of_the_run():
+    instrument = Instrumentation()
+    time.sleep(0.2)
+    assert instrument.summary()["elapsed"] == 0.
+    instrument.start()
+    assert instrument.summary()["elapsed"] < 0.1
+
+def test_stage_cpu_time_is_the_calling_thread_only():
+    instrument = Instrumentation()
+    instrument.start()
+    busy = threading.Thread(target=spin, args=(0.3,))
+    busy.start()
+    sample = {}
+    timed(sample, "sleep", time.sleep, 0.3)
+    busy.join()
+    wall, cpu = sample["sleep"]
+    assert wall >= 0.3 and cpu < 0.1
+    assert instrument.summary()["process_cpu"] > 0.1
@@ -0,0 +1,106 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from gvr_vanet.metrics import (MEASURES, PATH_MEASURES, adjacency, approx_samples, centralities, local_efficiency,
+                               maximal_matching, pagerank, path_measures)
+from gvr_vanet.snapshot import EDGE_DTYPE
+
+
+def graph(seed):
+    # A random component, a star, a triangle, a path, a pair and isolated
+    # vehicles, labels shuffled so the components interleave.
+    parts = [nx.gnp_random_graph(30, 0.15, seed=seed), nx.star_graph(5), nx.complete_graph(3), nx.path_graph(4),
+             nx.path_graph(2), nx.empty_graph(3)]
+    G = nx.disjoint_union_all(parts)
+    order = np.random.default_rng(seed).permutation(G.number_of_nodes())
+    G = nx.relabel_nodes(G, dict(enumerate(order.tolist())))
+    edges = sorted(tuple(sorted(e)) for e in G.edges())
+    # Edges added in sorted order, so networkx scans them as the greedy matching does.
+    H = nx.Graph()
+    H.add_nodes_from(range(G.number_of_nodes()))
+    H.add_edges_from(edges)
+    return H, adjacency(H.number_of_nodes(), np.array([(u, v, 1.) for u, v in edges], dtype=EDGE_DTYPE))
+
+def as_array(values, n):
+    return np.array([values[v] for v in range(n)])
+
+@pytest.fixture(params=[0, 1, 2])
+def graphs(request):
+    return graph(request.param)
+
+def test_path_measures(graphs):
+    G, adj = graphs
+    n = G.number_of_nodes()
+    count, dist_sum, harmonic_sum, _ = path_measures(adj)
+    lengths = dict(nx.all_pairs_shortest_path_length(G))
+    assert count.tolist() == [len(lengths[v]) - 1 for v in range(n)]
+    assert dist_sum.tolist() == [sum(lengths[v].values()) for v in range(n)]
+    assert np.allclose(harmonic_sum, [sum(1.0 / d for d in lengths[v].values() if d) for v in range(n)])
+
+def test_centralities(graphs):
+    G, adj = graphs
+    n = G.number_of_nodes()
+    results = centralities(adj, MEASURES)
+    assert np.allclose(results["degree"], as_array(nx.degree_centrality(G), n))
+    assert np.allclose(results["closeness"], as_array(nx.closeness_centrality(G), n))
+    assert np.allclose(results["betweenness"], as_array(nx.betweenness_centrality(G), n))
+    assert np.allclose(results["harmonic"], as_array(nx.harmonic_centrality(G), n))
+    assert np.isclose(results["global_efficiency"].mean(), nx.global_efficiency(G))
+
+def test_pagerank(graphs):
+    G, adj = graphs
+    rank = pagerank(adj, max_iter=1000, tol=1.0e-10)
+    assert np.isclose(rank.sum(), 1.0)
+    assert np.allclose(rank, as_array(nx.pagerank(G, max_iter=1000, tol=1.0e-10), G.number_of_nodes()), atol=1.0e-8)
+
+def test_local_efficiency(graphs):
+    G, adj = graphs
+    efficiency = local_efficiency(adj)
+    assert np.allclose(efficiency, [nx.global_efficiency(G.subgraph(G[v])) for v in G])
+    assert np.isclose(efficiency.mean(), nx.local_efficiency(G))
+
+def test_maximal_matching(graphs):
+    G, adj = graphs
+    matched = maximal_matching(adj).astype(bool)
+    expected = np.zeros(G.number_of_nodes(), dtype=bool)
+    for u, v in nx.maximal_matching(G):
+        expected[[u, v]] = True
+    assert (matched == expected).all()
+    # Maximal: no edge is left with both endpoints free.
+    assert all(matched[u] or matched[v] for u, v in G.edges())
+
+def test_small_graphs():
+    for n in (0, 1, 2):
+        adj = adjacency(n, np.array([(0, 1, 1.)] if n == 2 else [], dtype=EDGE_DTYPE))
+        results = centralities(adj, MEASURES)
+        assert all(len(values) == n for values in results.values())
+
+def test_approx_runs_repeat_with_a_seed(graphs):
+    G, adj = graphs
+    approx = dict(samples=12, seed=7)
+    first, second = centralities(adj, PATH_MEASURES, approx), centralities(adj, PATH_MEASURES, approx)
+    assert first.keys() == second.keys()
+    for measure in first:
+        assert np.array_equal(first[measure], second[measure])
+    other = centralities(adj, PATH_MEASURES, dict(samples=12, seed=8))
+    assert not np.array_equal(first["betweenness"], other["betweenness"])
+
+@pytest.mark.parametrize("seed", range(5))
+def test_approx_error_within_the_hoeffding_bound(seed):
+    # Nodal efficiency is a mean of inverse distances in [0, 1] over the pivots.
+    G = nx.convert_node_labels_to_integers(nx.grid_2d_graph(20, 20))
+    adj = adjacency(G.number_of_nodes(), np.array([(u, v, 1.) for u, v in G.edges()], dtype=EDGE_DTYPE))
+    epsilon = 0.2
+    results = centralities(adj, ("global_efficiency",), dict(epsilon=epsilon, delta=0.1, seed=seed))
+    assert results["approx_samples"] == approx_samples(epsilon=epsilon, delta=0.1) < G.number_of_nodes()
+    assert results["approx_error"] <= epsilon
+    exact = centralities(adj, ("global_efficiency",))["global_efficiency"]
+    assert np.abs(results["global_efficiency"] - exact).max() <= results["approx_error"]
+
+def test_approx_needs_a_budget_or_an_error(graphs):
+    G, adj = graphs
+    with pytest.raises(ValueError):
+        approx_samples()
+    with pytest.raises(ValueError):
+        centralities(adj, ("closeness",), dict(seed=1))
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+import gvr_vanet
+from gvr_vanet.replay import RecordingConnection, replay_simulation
+from gvr_vanet.sampler import sample_simulation
+
+MINUTES = 0.05
+
+
+class FakeSimulation(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def getMinExpectedNumber(self):
+        return int(self.conn.time < 10)
+
+    def getTime(self):
+        return float(self.conn.time)
+
+    def convertGeo(self, x, y, fromGeo=False):
+        return float(x), float(y)
+
+
+class FakeVehicle(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def getIDList(self):
+        return tuple("car%s"%i for i in range(self.conn.time // 3 + 1))
+
+    def getPosition(self, veh_id):
+        i = int(veh_id[3:])
+        return 10. * i + self.conn.time, 5. * i
+
+
+class FakeConnection(object):
+    # Answers the calls of the polling collector like a small TraCI session.
+    def __init__(self):
+        self.time = 0
+        self.simulation = FakeSimulation(self)
+        self.vehicle = FakeVehicle(self)
+
+    def simulationStep(self):
+        self.time += 1
+
+    def close(self):
+        pass
+
+def as_lists(samples):
+    return [[float(t), [int(i) for i in ids], [[float(v) for v in p] for p in pos]] for t, ids, pos in samples]
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / "session.pkl")
+    conn = RecordingConnection(FakeConnection(), path)
+    samples = as_lists(sample_simulation(None, MINUTES, conn=conn))
+    return path, samples
+
+def test_replay_without_sumo(recording):
+    path, samples = recording
+    assert [t for t, ids, pos in samples] == [0., 3., 6., 9.]
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(gvr_vanet.__file__))))
+    env.pop("SUMO_HOME", None)
+    # sumorunner exits without SUMO_HOME, so the replay would fail if it were imported.
+    script = ("import sys, json\n"
+              "from gvr_vanet.replay import replay_simulation\n"
+              "samples = replay_simulation(sys.argv[1], %s)\n"
+              "assert 'gvr_vanet.sumorunner' not in sys.modules and 'traci' not in sys.modules\n"
+              "print(json.dumps([[float(t), ids.tolist(), pos.tolist()] for t, ids, pos in samples]))\n")%(MINUTES)
+    result = subprocess.run([sys.executable, "-c", script, path], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout) == samples
+
+def test_replay_fails_on_a_different_call(recording):
+    path, samples = recording
+    with pytest.raises(ValueError, match="recorded"):
+        replay_simulation(path, 2 * MINUTES)
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+from gvr_vanet.trace import DatWriter, TraceWriter, index_path, load_index, read_snapshots
+
+
+def snapshot(t, n=5):
+    rng = np.random.default_rng(int(t))
+    return t, np.arange(n) + int(t), (rng.random((n, 2)) * 1000).astype(np.float32)
+
+@pytest.mark.parametrize("writer_class, name", [(DatWriter, "raw.dat"), (TraceWriter, "raw.gvrt")])
+def test_reading_while_a_writer_is_open(tmp_path, writer_class, name):
+    path = str(tmp_path / name)
+    with writer_class(path) as writer:
+        for t in range(0, 150, 30):
+            writer.write(*snapshot(t))
+        writer.flush()
+        sidecar = os.path.getsize(index_path(path))
+        # The index is completed in memory, the writer's sidecar is left alone.
+        assert load_index(path)['time'].tolist() == [0, 30, 60, 90, 120]
+        assert len(list(read_snapshots(path, last_read_time=0))) == 4
+        assert os.path.getsize(index_path(path)) == sidecar
+        for t in range(150, 300, 30):
+            writer.write(*snapshot(t))
+        writer.file.flush()
+        # Data flushed ahead of the sidecar is scanned.
+        assert load_index(path)['time'].tolist() == list(range(0, 300, 30))
+    times = load_index(path, update=False)['time'].tolist()
+    assert times == list(range(0, 300, 30))
+    assert len(list(read_snapshots(path, last_read_time=0))) == 9
+
+def test_half_written_dat_snapshot_is_not_indexed(tmp_path):
+    path = str(tmp_path / "raw.dat")
+    with DatWriter(path) as writer:
+        writer.write(*snapshot(0))
+    with open(path, "ab") as f:
+        f.write(b"1:2.0:3.0\nEND 12")
+    assert load_index(path)['time'].tolist() == [0]
+
+def test_reopened_writer_repairs_the_sidecar(tmp_path):
+    path = str(tmp_path / "raw.gvrt")
+    with TraceWriter(path, index=False) as writer:
+        for t in (0, 30, 60):
+            writer.write(*snapshot(t))
+    with TraceWriter(path) as writer:
+        writer.write(*snapshot(90))
+    assert load_index(path, update=False)['time'].tolist() == [0, 30, 60, 90]
@@ -0,0 +1,33 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from gvr_vanet.trace import DatWriter
+from gvr_vanet.workqueue import WorkQueue, run_worker, shard_path
+
+
+def write_trace(path, n_vehicles):
+    rng = np.random.default_rng(n_vehicles)
+    with DatWriter(path) as writer:
+        for t in range(0, 120, 30):
+            writer.write(t, np.arange(n_vehicles), (rng.random((n_vehicles, 2)) * 1000).astype(np.float32))
+
+def test_traces_sharing_a_name_get_their_own_shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    traces = []
+    for name, n_vehicles in (("s1", 20), ("s2", 30)):
+        os.makedirs(name)
+        traces.append(os.path.join(name, "raw_graph.dat"))
+        write_trace(traces[-1], n_vehicles)
+    assert shard_path("results", traces[0], 0, 4) != shard_path("results", traces[1], 0, 4)
+    assert shard_path("results", traces[0], 0, 4) == shard_path("results", os.path.abspath(traces[0]), 0, 4)
+    with WorkQueue("queue.db") as queue:
+        assert queue.publish(traces[0], "results") == 1
+        assert queue.publish(traces[1], "results") == 1
+    assert run_worker("queue.db", "test", poll=0.01) == 2
+    for trace, n_vehicles in zip(traces, (20, 30)):
+        conn = sqlite3.connect(shard_path("results", trace, 0, 4))
+        counts = conn.execute("SELECT count(*) FROM metrics WHERE measure = 'degree' GROUP BY time").fetchall()
+        conn.close()
+        assert counts == [(n_vehicles,)] * 4
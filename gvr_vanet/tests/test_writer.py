@@ -0,0 +1,41 @@
+import sqlite3
+import threading
+
+import numpy as np
+
+from gvr_vanet.graph import measure_graphs
+from gvr_vanet.store import SCHEMA, DBAPISink
+from gvr_vanet.trace import DatWriter
+from gvr_vanet.writer import BufferedWriter
+
+
+class ThreadSink(object):
+    def __init__(self, thread_safe):
+        self.thread_safe = thread_safe
+        self.batches = []
+
+    def write(self, batch):
+        self.batches.append(([data["time"] for data in batch], threading.current_thread()))
+
+
+def test_sinks_that_are_not_thread_safe_are_written_by_the_caller():
+    for thread_safe in (True, False):
+        sink = ThreadSink(thread_safe)
+        with BufferedWriter(sink, batch_size=2) as writer:
+            for t in range(5):
+                writer.append(dict(time=t))
+        assert [times for times, _ in sink.batches] == [[0, 1], [2, 3], [4]]
+        assert all((thread is threading.current_thread()) != thread_safe for _, thread in sink.batches)
+
+def test_plain_sqlite_connection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    with DatWriter("raw.dat") as writer:
+        for t in range(0, 300, 30):
+            writer.write(t, np.arange(50), (rng.random((50, 2)) * 1000).astype(np.float32))
+    # Created in this thread with the default check_same_thread.
+    conn = sqlite3.connect(str(tmp_path / "metrics.db"))
+    conn.executescript(SCHEMA)
+    measure_graphs("raw.dat", 1, store=DBAPISink(conn), batch_size=3)
+    assert conn.execute("SELECT time FROM checkpoint").fetchone() == (270.,)
+    assert conn.execute("SELECT count(DISTINCT time) FROM metrics").fetchone() == (10,)